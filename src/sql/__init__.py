@@ -38,10 +38,10 @@ from sql.conditionals import (
 
 from sql.core import (
     Flavor, AliasManager, Query, WithQuery, FromItem, Lateral, With,
-    SelectQuery, Select, Insert, Update, Delete, CombiningQuery, Union,
-    Intersect, Except, Table, Join, From, Values, Expression, Literal, _Rownum,
-    Column, As, Cast, Window, Order, Asc, Desc, NullOrder, NullsFirst,
-    NullsLast, For, Null, _rownum)
+    SelectQuery, Select, Insert, Conflict, Update, Delete, Copy,
+    CombiningQuery, Union, Intersect, Except, Table, Join, From, Values,
+    Expression, Literal, _Rownum, Column, As, Cast, Window, Order, Asc, Desc,
+    NullOrder, NullsFirst, NullsLast, For, Null, _rownum)
 
 from sql.functions import (
     Abs, Cbrt, Ceil, Degrees, Div, Exp, Floor, Ln,
@@ -74,11 +74,11 @@ __version__ = '0.9.0-dev0'
 __all__ = (
     # Core
     'Flavor', 'AliasManager', 'Query', 'WithQuery', 'FromItem', 'Lateral',
-    'With', 'SelectQuery', 'Select', 'Insert', 'Update', 'Delete',
-    'CombiningQuery', 'Union', 'Intersect', 'Except', 'Table', 'Join', 'From',
-    'Values', 'Expression', 'Literal', '_Rownum', 'Column', 'As', 'Cast',
-    'Window', 'Order', 'Asc', 'Desc', 'NullOrder', 'NullsFirst', 'NullsLast',
-    'For', 'Null', '_rownum',
+    'With', 'SelectQuery', 'Select', 'Insert', 'Conflict', 'Update', 'Delete',
+    'Copy', 'CombiningQuery', 'Union', 'Intersect', 'Except', 'Table', 'Join',
+    'From', 'Values', 'Expression', 'Literal', '_Rownum', 'Column', 'As',
+    'Cast', 'Window', 'Order', 'Asc', 'Desc', 'NullOrder', 'NullsFirst',
+    'NullsLast', 'For', 'Null', '_rownum',
 
     # Aggregate
     'Avg', 'BitAnd', 'BitOr', 'BoolAnd', 'BoolOr', 'Count', 'Every',
@@ -46,6 +46,7 @@ if PY3:
     zip = zip
 
     text_type = str
+    binary_type = bytes
     string_types = str,
     integer_types = int,
 
@@ -58,5 +59,6 @@ elif PY2:
     zip = izip
 
     text_type = unicode
+    binary_type = str
     string_types = unicode, str
     integer_types = int, long
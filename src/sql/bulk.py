@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011-2016, Cédric Krier
+# Copyright (c) 2011-2016, B2CK
+# Copyright (c) 2016-2016, Victor Uriarte
+# and contributors. See AUTHORS for more details.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from copy import copy
+from itertools import islice
+
+from sql.core import (
+    Flavor, Table, Column, Values, Insert, Update, From, Copy)
+from sql.conditionals import Case
+from sql.operators import And, Or, In
+from sql._compat import text_type, map, zip
+
+__all__ = ('insert_many', 'update_many', 'batches', 'split_in', 'stage')
+
+
+def chunk_size(width, reserved=0):
+    """Return the number of rows of width parameters that fit in a query
+
+    reserved is the number of parameters used by the rest of the query.
+    Returns None if the flavor has no parameter limit.
+    """
+    max_params = Flavor.get().max_params
+    if not max_params:
+        return None
+    return max(1, (max_params - reserved) // max(width, 1))
+
+
+def chunks(rows, size):
+    "Yield lists of at most size rows"
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size)) if size else list(rows)
+        if not chunk:
+            break
+        yield chunk
+
+
+def insert_many(table, columns, rows, on_conflict=None, returning=None):
+    """Yield multi-row Insert queries of rows
+
+    The queries are chunked to fit in the parameter limit of the flavor.
+    on_conflict is a Conflict to upsert the rows.
+    """
+    size = chunk_size(len(columns))
+    for chunk in chunks(rows, size):
+        yield Insert(table, columns, [list(r) for r in chunk],
+                     on_conflict=on_conflict, returning=returning)
+
+
+def _keys(keys, values):
+    if len(keys) == 1:
+        return keys[0] == values[0]
+    return And([k == v for k, v in zip(keys, values)])
+
+
+def update_many(table, keys, columns, rows):
+    """Yield Update queries setting the columns of each row found by keys
+
+    rows is an iterable of (key, values) where key is the value of keys
+    (a tuple if there are many) and values are the new values of columns.
+    The queries are chunked to fit in the parameter limit of the flavor.
+    When the flavor does not support UPDATE FROM, a CASE per column is
+    used instead of joining a VALUES.
+    """
+    if isinstance(keys, Column):
+        keys = [keys]
+    keys = list(keys)
+    columns = list(columns)
+
+    def normalize(row):
+        key, values = row
+        if len(keys) == 1:
+            key = (key,)
+        return tuple(key), list(values)
+    rows = map(normalize, rows)
+
+    if Flavor.get().update_from:
+        size = chunk_size(len(keys) + len(columns))
+        for chunk in chunks(rows, size):
+            values = Values([k + tuple(v) for k, v in chunk],
+                            columns=[c.name for c in keys + columns])
+            yield Update(table, columns,
+                         [Column(values, c.name) for c in columns],
+                         from_=[values],
+                         where=_keys(keys, [Column(values, k.name)
+                                            for k in keys]))
+    else:
+        size = chunk_size(len(columns) * (len(keys) + 1) + len(keys))
+        for chunk in chunks(rows, size):
+            values = [Case(*[(_keys(keys, k), v[i]) for k, v in chunk],
+                           else_=column)
+                      for i, column in enumerate(columns)]
+            if len(keys) == 1:
+                where = In(keys[0], [k[0] for k, _ in chunk])
+            else:
+                where = Or([_keys(keys, k) for k, _ in chunk])
+            yield Update(table, columns, values, where=where)
+
+
+def batches(query, key, size=1000):
+    """Yield copies of the Delete or Update query bounded to size rows
+
+    Each query only affects the next size rows of the table in key order
+    selected by a subquery. The greatest key processed may be sent to the
+    generator to advance the keyset, otherwise the next query starts again
+    from the lowest key. The generator is endless, the caller stops when
+    no more rows are affected.
+    Without the in_limit flavor, like MySQL, the subquery is wrapped into a
+    derived table which is materialized before the modification.
+    """
+    last = None
+    while True:
+        where = query.where
+        if last is not None:
+            where = where & (key > last) if where else key > last
+        from_ = From([query.table])
+        batch = copy(query)
+        page = from_.select(key, where=where, order_by=key, limit=size)
+        if not Flavor.get().in_limit:
+            page = page.select(Column(page, key.name))
+        batch.where = In(key, page)
+        if getattr(query, 'from_', None):
+            from_.extend(query.from_)
+            # The joined tables are not correlated to the subquery
+            if query.where:
+                batch.where = query.where & batch.where
+        sent = yield batch
+        if sent is not None:
+            last = sent
+
+
+def split_in(query, in_, size=None):
+    """Yield copies of the Select query with the values of in_ split
+
+    in_ is an In of the where clause. Each query filters on at most size
+    values (by default what fits in the parameter limit of the flavor)
+    and the caller concatenates the results. It is only valid when the
+    rows of the query are independent (no aggregate, DISTINCT or LIMIT).
+    """
+    if type(in_) is not In:
+        raise ValueError('Only IN can be split into many queries')
+    if size is None:
+        size = chunk_size(1, len(query.params) - len(in_.right))
+    for chunk in chunks(in_.right, size):
+        batch = copy(query)
+        batch.where = _replace(query.where, in_, In(in_.left, chunk))
+        yield batch
+
+
+def _replace(where, old, new):
+    if where is old:
+        return new
+    elif isinstance(where, And):
+        return And(new if w is old else w for w in where._flat())
+    raise ValueError('IN must be a condition of the where clause')
+
+
+def stage(query, column, keys, type_='BIGINT', name='staged_keys',
+          copy_=False):
+    """Return the steps to run the Select query filtered by column on keys
+    staged in a temporary table
+
+    The steps are a list of (sql, params) to execute in order on the same
+    connection: the creation of the temporary table, the load of the keys,
+    the query joined to the table and the drop of the table. The keys are
+    loaded by chunked inserts or if copy_ is set by a COPY for which
+    params is the file-like object to pass to copy_expert.
+    """
+    from sql.optimize import _distinct, _join
+    table = Table(name)
+    key = Column(table, column.name)
+    from_ = _join(query.from_, column.table, table, column == key)
+    if from_ is None:
+        raise ValueError('Column must be from a table of the query')
+    staged = copy(query)
+    staged.from_ = from_
+
+    rows = [[k] for k in _distinct(keys)]
+    create = 'CREATE TEMPORARY TABLE {} ("{}" {})'.format(
+        table, column.name, type_)
+    steps = [(create, ())]
+    if copy_:
+        load = Copy(table, [key])
+        steps.append((text_type(load), load.buffer(rows)))
+    else:
+        steps.extend(tuple(q) for q in insert_many(table, [key], rows))
+    steps.append(tuple(staged))
+    steps.append(('DROP TABLE {}'.format(table), ()))
+    return steps
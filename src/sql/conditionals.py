@@ -58,15 +58,14 @@ class Case(Conditional):
         self.else_ = kwargs.get('else_')
 
     def __str__(self):
-        when_tpl = 'WHEN {} THEN {} '.format
-        else_tpl = 'ELSE {} '.format
-        case = 'CASE '
-        for cond, result in self.whens:
-            case += when_tpl(self._format(cond), self._format(result))
+        when_tpl = 'WHEN {} THEN {}'.format
+        case = ['CASE']
+        case.extend(when_tpl(self._format(cond), self._format(result))
+                    for cond, result in self.whens)
         if self.else_ is not None:
-            case += else_tpl(self._format(self.else_))
-        case += 'END'
-        return case
+            case.append('ELSE {}'.format(self._format(self.else_)))
+        case.append('END')
+        return ' '.join(case)
 
     @property
     def params(self):
@@ -29,10 +29,15 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import io
+import struct
+from binascii import hexlify
 from collections import defaultdict
+from copy import copy
 from threading import currentThread, local
 
-from sql._compat import text_type, map, zip
+from sql._compat import (
+    text_type, binary_type, string_types, integer_types, map, zip)
 from sql.utils import csv_str, csv_map, alias
 
 __all__ = ('Flavor', 'Table', 'Values', 'Literal', 'Column', 'Join',
@@ -50,11 +55,27 @@ class Flavor(object):
         no_as - doesn't support AS keyword for column and table
         null_ordering - support NULL ordering
         function_mapping - dictionary with Function to replace
+        max_params - maximum number of parameters per query
+        update_from - support FROM clause in UPDATE
+        upsert - style of conflict handling of INSERT: 'on_conflict',
+            'on_duplicate' or 'merge'
+        row_values - support comparison of row values
+        in_array - send IN list as a single array parameter
+        in_buckets - pad IN list to the next power of two if True or to the
+            next of the given sizes
+        max_in - maximum number of values in IN list
+        in_join_threshold - number of values of IN list from which
+            optimize.in_to_join joins a VALUES instead
+        in_exists - rewrite IN subqueries as EXISTS in optimize.in_to_exists
+        in_limit - support LIMIT in IN subquery reading the modified table
     """
 
     def __init__(self, limitstyle='limit', max_limit=None, paramstyle='format',
                  ilike=False, no_as=False, no_boolean=False,
-                 null_ordering=True, function_mapping=None):
+                 null_ordering=True, function_mapping=None, max_params=None,
+                 update_from=True, upsert='on_conflict', row_values=True,
+                 in_array=False, in_buckets=None, max_in=None,
+                 in_join_threshold=None, in_exists=False, in_limit=True):
         self.limitstyle = limitstyle
         self.max_limit = max_limit
         self.paramstyle = paramstyle
@@ -63,6 +84,16 @@ class Flavor(object):
         self.no_boolean = no_boolean
         self.null_ordering = null_ordering
         self.function_mapping = function_mapping or {}
+        self.max_params = max_params
+        self.update_from = update_from
+        self.upsert = upsert
+        self.row_values = row_values
+        self.in_array = in_array
+        self.in_buckets = in_buckets
+        self.max_in = max_in
+        self.in_join_threshold = in_join_threshold
+        self.in_exists = in_exists
+        self.in_limit = in_limit
 
     @property
     def param(self):
@@ -154,13 +185,15 @@ class Query(object):
         yield self.params
 
     def __or__(self, other):
-        return Union(self, other)
+        return Union(*(_combined(Union, self) + _combined(Union, other)))
 
     def __and__(self, other):
-        return Intersect(self, other)
+        return Intersect(
+            *(_combined(Intersect, self) + _combined(Intersect, other)))
 
     def __sub__(self, other):
-        return Except(self, other)
+        # EXCEPT is not associative so only the left side is merged
+        return Except(*(_combined(Except, self) + (other,)))
 
 
 class WithQuery(Query):
@@ -329,9 +362,43 @@ class SelectQuery(WithQuery):
                 fetch = ' FETCH FIRST ({}) ROWS ONLY'.format(self.limit)
             return offset + fetch
 
+    def _derived(self):
+        "Return a copy of the query without WITH and ORDER BY and the WITH"
+        query = copy(self)
+        query.with_, query.order_by = None, None
+        if isinstance(query, Select):
+            from sql.optimize import _has_aggregate
+            query.for_ = None
+            # Without GROUP BY, aggregates return a single row
+            if query.group_by or not _has_aggregate(query.columns):
+                query.columns = [Literal(1)]
+        return query, self.with_
+
+    def count(self):
+        """Return a Select of the number of rows returned by the query
+
+        The ORDER BY is removed and the columns are replaced by a constant
+        if it does not change the number of rows."""
+        from sql.aggregate import Count
+        query, with_ = self._derived()
+        return query.select(Count(_star), with_=with_)
+
+    def exists(self):
+        """Return a Select testing if the query returns any row
+
+        The ORDER BY is removed, the columns are replaced by a constant if
+        it does not change the number of rows and only one row is fetched.
+        """
+        from sql.operators import Exists
+        query, with_ = self._derived()
+        if query.offset is None:
+            query.limit = 1 if query.limit is None else min(query.limit, 1)
+        return Select([Exists(query)], with_=with_)
+
 
 class Select(FromItem, SelectQuery):
-    __slots__ = ('_columns', 'where', '_group_by', 'having', '_for_', 'from_')
+    __slots__ = ('_columns', 'where', '_group_by', 'having', '_for_', 'from_',
+                 '_compiled_windows')
 
     def __init__(self, columns, from_=None, where=None, group_by=None,
                  having=None, for_=None, **kwargs):
@@ -350,6 +417,7 @@ class Select(FromItem, SelectQuery):
         self.from_ = from_
         self.where = where
         self.having = having
+        self._compiled_windows = None
 
     @property
     def columns(self):
@@ -385,21 +453,87 @@ class Select(FromItem, SelectQuery):
         else:
             return text_type(column)
 
-    def _window_functions(self):
+    def _windows(self):
+        """Return the windows of the columns paired with the structurally
+        identical window which defines them"""
+        if self._compiled_windows is not None:
+            return self._compiled_windows
         from sql.functions import WindowFunction
         from sql.aggregate import Aggregate
-        windows = set()
-        for column in self.columns:
-            window_function = None
-            tps = WindowFunction, Aggregate
-            if isinstance(column, tps):
-                window_function = column
-            elif isinstance(column, As) and isinstance(column.expression, tps):
-                window_function = column.expression
-            if window_function and window_function.window and (
-                    window_function.window not in windows):
-                windows.add(window_function.window)
-                yield window_function
+        windows, definitions, seen = [], [], set()
+        with AliasManager():
+            for column in self.columns:
+                if isinstance(column, As):
+                    column = column.expression
+                if not isinstance(column, (WindowFunction, Aggregate)):
+                    continue
+                window = column.window
+                if not window or id(window) in seen:
+                    continue
+                seen.add(id(window))
+                key = (text_type(window), window.params)
+                for other_key, definition in definitions:
+                    if other_key == key:
+                        break
+                else:
+                    definition = window
+                    definitions.append((key, window))
+                windows.append((window, definition))
+        return windows
+
+    def paginate_after(self, values):
+        """Return a copy of the query for the rows following values
+
+        values are the values of the order_by expressions of the last row
+        of the previous page.
+        """
+        from sql.operators import And, Or, Equal, Greater, Less
+        if not self.order_by:
+            raise ValueError('Keyset pagination requires an order_by')
+        keys = []
+        for expression in self.order_by:
+            if isinstance(expression, NullOrder):
+                raise ValueError('Keyset pagination can not order NULLS')
+            elif isinstance(expression, Desc):
+                keys.append((expression.expression, Less))
+            elif isinstance(expression, Asc):
+                keys.append((expression.expression, Greater))
+            else:
+                keys.append((expression, Greater))
+        values = tuple(values)
+        operators = set(o for _, o in keys)
+        if len(keys) == 1:
+            (expression, operator), = keys
+            seek = operator(expression, values[0])
+        elif len(operators) == 1 and Flavor.get().row_values:
+            operator, = operators
+            seek = operator(tuple(e for e, _ in keys), values)
+        else:
+            seek = Or()
+            for i, (expression, operator) in enumerate(keys):
+                term = operator(expression, values[i])
+                if i:
+                    term = And([Equal(e, v) for (e, _), v in zip(
+                                keys[:i], values)] + [term])
+                seek.append(term)
+        query = copy(self)
+        query.where = self.where & seek if self.where else seek
+        query.offset = None
+        return query
+
+    def iter_pages(self, size):
+        """Yield the queries of the successive pages of size rows
+
+        The values of the order_by expressions of the last row of a page must
+        be sent to the generator to get the query of the next page.
+        """
+        query = copy(self)
+        query.offset = None
+        while True:
+            query.limit = size
+            values = yield query
+            if values is not None:
+                query = self.paginate_after(values)
 
     def _rownum(self, func):
         aliases = [c.output_name if isinstance(c, As) else None
@@ -444,7 +578,11 @@ class Select(FromItem, SelectQuery):
             return self._rownum(text_type)
 
         with AliasManager():
-            from_ = text_type(self.from_)
+            from_ = text_type(self.from_) if self.from_ else ''
+            windows = self._windows()
+            for window, definition in windows:
+                if definition is not window:
+                    AliasManager.set(window, definition.alias)
             if self.columns:
                 columns = csv_map(self._format_column, self.columns)
             else:
@@ -459,15 +597,17 @@ class Select(FromItem, SelectQuery):
             if self.having:
                 having = ' HAVING ' + text_type(self.having)
             window = ''
-            windows = [f.window for f in self._window_functions()]
+            windows = [w for w, d in windows if w is d]
             if windows:
                 window = ' WINDOW ' + ', '.join(
                     '"{}" AS ({})'.format(w.alias, w) for w in windows)
             for_ = ''
             if self.for_ is not None:
                 for_ = ' ' + ' '.join(map(text_type, self.for_))
+            if from_:
+                from_ = ' FROM ' + from_
             return (self._with_str() +
-                    'SELECT {} FROM {}'.format(columns, from_) +
+                    'SELECT {}{}'.format(columns, from_) +
                     where + group_by + having + window + self._order_by_str +
                     self._limit_offset_str + for_)
 
@@ -482,7 +622,8 @@ class Select(FromItem, SelectQuery):
             if isinstance(column, As):
                 p.extend(column.expression.params)
             p.extend(column.params)
-        p.extend(self.from_.params)
+        if self.from_:
+            p.extend(self.from_.params)
         if self.where:
             p.extend(self.where.params)
         if self.group_by:
@@ -493,16 +634,26 @@ class Select(FromItem, SelectQuery):
                 p.extend(expression.params)
         if self.having:
             p.extend(self.having.params)
-        for window_function in self._window_functions():
-            p.extend(window_function.window.params)
+        for window, definition in self._windows():
+            if window is definition:
+                p.extend(window.params)
         return tuple(p)
 
+    def __iter__(self):
+        # Compute the windows once for both the string and the params
+        self._compiled_windows = self._windows()
+        try:
+            for value in super(Select, self).__iter__():
+                yield value
+        finally:
+            self._compiled_windows = None
+
 
 class Insert(WithQuery):
-    __slots__ = ('table', 'columns', '_values', 'returning')
+    __slots__ = ('table', 'columns', '_values', 'returning', 'on_conflict')
 
     def __init__(self, table, columns=None, values=None, returning=None,
-                 **kwargs):
+                 on_conflict=None, **kwargs):
         super(Insert, self).__init__(**kwargs)
         self._values = None
         self.values = values
@@ -510,6 +661,7 @@ class Insert(WithQuery):
         self.table = table
         self.columns = columns
         self.returning = returning
+        self.on_conflict = on_conflict
 
     @property
     def values(self):
@@ -531,7 +683,7 @@ class Insert(WithQuery):
             return param
 
     def __str__(self):
-        returning = values = columns = ''
+        returning = values = columns = on_conflict = ''
 
         if self.columns:
             columns = ' (' + csv_str(self.columns) + ')'
@@ -544,9 +696,64 @@ class Insert(WithQuery):
 
         if self.returning:
             returning = ' RETURNING ' + csv_str(self.returning)
+        if self.on_conflict:
+            if Flavor.get().upsert == 'merge':
+                if self.returning:
+                    raise ValueError('MERGE can not return the rows')
+                return self._merge_str()
+            on_conflict = ' ' + self.on_conflict.format(self.columns)
         with AliasManager():
             return (self._with_str() + 'INSERT INTO {}'.format(self.table) +
-                    columns + values + returning)
+                    columns + values + on_conflict + returning)
+
+    def _merge_str(self):
+        """Return the MERGE statement of the upsert
+
+        With the rownum limitstyle of Oracle, which does not support column
+        aliases on a derived table, the VALUES rows are selected from dual
+        and a query source must name its columns like the inserted ones.
+        Otherwise the statement is terminated by a semicolon.
+        """
+        from sql.operators import And
+        if not self.columns:
+            raise ValueError('MERGE requires the inserted columns')
+        name = '"{}"'.format
+        columns = [c.name for c in self.columns]
+        flavor = Flavor.get()
+        with AliasManager():
+            target = text_type(From([self.table]))
+            source = self.values
+            condition = And([Column(self.table, c) == Column(source, c)
+                             for c in self.on_conflict.names])
+            if len(condition) == 1:
+                condition, = condition
+            alias_template = ' "{}"' if flavor.no_as else ' AS "{}"'
+            alias = alias_template.format(source.alias)
+            if flavor.limitstyle != 'rownum':
+                values = text_type(source)
+                alias += ' ({})'.format(csv_map(name, columns))
+            elif isinstance(source, Values):
+                values = ' UNION ALL '.join(
+                    'SELECT {} FROM dual'.format(', '.join(
+                        self._format(v) + alias_template.format(c)
+                        for v, c in zip(row, columns)))
+                    for row in source)
+            else:
+                values = text_type(source)
+            merge = 'MERGE INTO {} USING ({}){} ON {}'.format(
+                target, values, alias, condition)
+            update = self.on_conflict.updated(self.columns)
+            if update:
+                merge += ' WHEN MATCHED THEN UPDATE SET ' + ', '.join(
+                    '{} = {}'.format(name(c), Column(source, c))
+                    for c in update)
+            merge += ' WHEN NOT MATCHED THEN INSERT ({}) VALUES ({})'.format(
+                csv_map(name, columns),
+                csv_str(Column(source, c) for c in columns))
+            # SQL Server requires the terminator which Oracle refuses
+            if flavor.limitstyle != 'rownum':
+                merge += ';'
+            return self._with_str() + merge
 
     @property
     def params(self):
@@ -560,6 +767,51 @@ class Insert(WithQuery):
         return tuple(p)
 
 
+class Conflict(object):
+    """Conflict handling of Insert
+
+    columns are the unique columns which may conflict and update the
+    columns to set from the proposed row, by default all the other inserted
+    columns. If update is empty, the conflicting rows are skipped.
+    """
+    __slots__ = ('columns', 'update')
+
+    def __init__(self, *columns, **kwargs):
+        self.columns = columns
+        self.update = kwargs.get('update')
+
+    @property
+    def names(self):
+        return [c.name for c in self.columns]
+
+    def updated(self, columns):
+        "Return the names of the updated columns among the inserted columns"
+        if self.update is not None:
+            return [c.name for c in self.update]
+        if not columns:
+            raise ValueError(
+                'Conflict requires the inserted columns or the update')
+        return [c.name for c in columns if c.name not in self.names]
+
+    def format(self, columns):
+        name = '"{}"'.format
+        upsert = Flavor.get().upsert
+        update = self.updated(columns)
+        if upsert == 'on_duplicate':
+            if not update:
+                update = self.names[:1]
+                value = name
+            else:
+                value = 'VALUES("{}")'.format
+            return 'ON DUPLICATE KEY UPDATE ' + ', '.join(
+                '{} = {}'.format(name(c), value(c)) for c in update)
+        conflict = 'ON CONFLICT ({}) '.format(csv_map(name, self.names))
+        if not update:
+            return conflict + 'DO NOTHING'
+        return conflict + 'DO UPDATE SET ' + ', '.join(
+            '{0} = EXCLUDED.{0}'.format(name(c)) for c in update)
+
+
 class Update(Insert):
     __slots__ = ('where', '_values', 'from_')
 
@@ -656,6 +908,138 @@ class Delete(WithQuery):
         return tuple(p)
 
 
+class Copy(Query):
+    """COPY FROM STDIN statement of PostgreSQL
+
+    The rows are not part of the statement, they are encoded by `encode` or
+    `buffer` into the stream expected by the server for the format_.
+    On Python 2, str is text so bytea values must be a bytearray.
+    """
+    __slots__ = ('table', 'columns', 'format_')
+    _formats = ('text', 'csv', 'binary')
+
+    def __init__(self, table, columns=None, format_='text'):
+        super(Copy, self).__init__()
+        if format_ not in self._formats:
+            raise ValueError('Unknown COPY format: {}'.format(format_))
+        self.table = table
+        self.columns = columns
+        self.format_ = format_
+
+    def __str__(self):
+        columns = ''
+        if self.columns:
+            columns = ' (' + csv_str(self.columns) + ')'
+        options = ''
+        if self.format_ != 'text':
+            options = ' WITH (FORMAT {})'.format(self.format_)
+        return 'COPY {}{} FROM STDIN'.format(self.table, columns) + options
+
+    @staticmethod
+    def _text(value):
+        if value is None:
+            return '\\N'
+        elif value is True or value is False:
+            return 't' if value else 'f'
+        elif (isinstance(value, (binary_type, bytearray))
+                and not isinstance(value, string_types)):
+            return '\\\\x' + hexlify(value).decode('ascii')
+        return (text_type(value).replace('\\', '\\\\')
+                .replace('\n', '\\n').replace('\r', '\\r')
+                .replace('\t', '\\t'))
+
+    @staticmethod
+    def _csv(value):
+        if value is None:
+            return ''
+        elif value is True or value is False:
+            return 't' if value else 'f'
+        elif (isinstance(value, (binary_type, bytearray))
+                and not isinstance(value, string_types)):
+            return '\\x' + hexlify(value).decode('ascii')
+        value = text_type(value)
+        if (not value or value == '\\.'
+                or any(c in value for c in ',"\r\n')):
+            value = '"{}"'.format(value.replace('"', '""'))
+        return value
+
+    @staticmethod
+    def _binary(value):
+        if value is None:
+            return struct.pack('!i', -1)
+        elif value is True or value is False:
+            data = b'\x01' if value else b'\x00'
+        elif isinstance(value, integer_types):
+            data = struct.pack('!q', value)
+        elif isinstance(value, float):
+            data = struct.pack('!d', value)
+        elif isinstance(value, string_types):
+            data = text_type(value).encode('utf-8')
+        elif isinstance(value, (binary_type, bytearray)):
+            data = bytes(value)
+        else:
+            raise TypeError(
+                'Can not encode {!r} in binary COPY'.format(value))
+        return struct.pack('!i', len(data)) + data
+
+    def encode(self, rows):
+        """Yield the COPY data of rows as bytes
+
+        rows is an iterable of sequences of values or a Values.
+        In binary format, int is sent as int8, float as float8, text as
+        UTF-8 and bytes as is, so the column types must match.
+        """
+        for row in rows:
+            if any(isinstance(v, Expression) for v in row):
+                raise ValueError('Can not COPY expressions')
+            if self.format_ == 'binary':
+                yield struct.pack('!h', len(row)) + b''.join(
+                    map(self._binary, row))
+            else:
+                if self.format_ == 'csv':
+                    line = ','.join(map(self._csv, row))
+                else:
+                    line = '\t'.join(map(self._text, row))
+                yield (line + '\n').encode('utf-8')
+
+    def _stream(self, rows):
+        if self.format_ == 'binary':
+            yield b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+        for data in self.encode(rows):
+            yield data
+        if self.format_ == 'binary':
+            yield struct.pack('!h', -1)
+
+    def buffer(self, rows):
+        """Return a file-like object streaming the COPY data of rows
+
+        The result is suitable for the copy_expert method of psycopg2.
+        """
+        return io.BufferedReader(_CopyReader(self._stream(rows)))
+
+
+class _CopyReader(io.RawIOBase):
+
+    def __init__(self, chunks):
+        super(_CopyReader, self).__init__()
+        self._chunks = chunks
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._pending))
+        b[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
 class CombiningQuery(FromItem, SelectQuery):
     __slots__ = ('queries', 'all_')
     _operator = ''
@@ -683,6 +1067,15 @@ class CombiningQuery(FromItem, SelectQuery):
         return tuple(p)
 
 
+def _combined(cls, query):
+    "Return the queries to merge into a cls combination with query"
+    if (type(query) is cls and not query.all_ and not query.with_
+            and not query.order_by
+            and query.limit is None and query.offset is None):
+        return tuple(query.queries)
+    return (query,)
+
+
 class Union(CombiningQuery):
     __slots__ = ()
     _operator = 'UNION'
@@ -699,13 +1092,17 @@ class Except(CombiningQuery):
 
 
 class Table(FromItem):
-    __slots__ = ('_name', '_schema', '_database')
+    __slots__ = ('_name', '_schema', '_database', '_keys')
 
-    def __init__(self, name, schema=None, database=None):
+    def __init__(self, name, schema=None, database=None, keys=None):
         super(Table, self).__init__()
         self._name = name
         self._schema = schema
         self._database = database
+        # The primary and unique keys as column name or tuple of names
+        self._keys = tuple(
+            (k,) if isinstance(k, string_types) else tuple(k)
+            for k in keys or ())
 
     def __str__(self):
         if self._database:
@@ -729,6 +1126,9 @@ class Table(FromItem):
     def delete(self, *args, **kwargs):
         return Delete(self, *args, **kwargs)
 
+    def copy_from(self, *args, **kwargs):
+        return Copy(self, *args, **kwargs)
+
 
 class Join(FromItem):
     __slots__ = ('left', 'right', 'condition', '_type_')
@@ -821,10 +1221,19 @@ class From(list):
 
 
 class Values(list, Query, FromItem):
-    __slots__ = ()
+    __slots__ = ('columns',)
 
     # TODO order, fetch
 
+    def __init__(self, values=(), columns=None):
+        super(Values, self).__init__(values)
+        self.columns = columns
+
+    @property
+    def columns_definitions(self):
+        if self.columns:
+            return ', '.join('"{}"'.format(c) for c in self.columns)
+
     def __str__(self):
         param = Flavor.get().param
 
@@ -1015,6 +1424,15 @@ class _Rownum(Expression):
         return tuple()
 
 
+class _Star(Expression):
+    def __str__(self):
+        return '*'
+
+    @property
+    def params(self):
+        return tuple()
+
+
 class Column(Expression):
     __slots__ = ('_from', 'name')
 
@@ -1259,3 +1677,4 @@ class For(object):
 
 Null = None
 _rownum = _Rownum()
+_star = _Star()
@@ -31,7 +31,7 @@
 
 from array import array
 
-from sql.core import Flavor, Select, CombiningQuery, Expression
+from sql.core import Flavor, Query, Select, CombiningQuery, Expression
 from sql.functions import Upper
 from sql._compat import text_type, map
 
@@ -59,21 +59,21 @@ class Operator(Expression):
 
     @property
     def params(self):
-
-        def convert(operands):
-            params = []
-            for operand in operands:
-                if isinstance(operand, (Expression, Select, CombiningQuery)):
-                    params.extend(operand.params)
-                elif isinstance(operand, (list, tuple)):
-                    params.extend(convert(operand))
-                elif isinstance(operand, array):
-                    params.extend(operand)
-                else:
-                    params.append(operand)
-            return params
-
-        return tuple(convert(self._operands))
+        return tuple(self._convert(self._operands))
+
+    @classmethod
+    def _convert(cls, operands):
+        params = []
+        for operand in operands:
+            if isinstance(operand, (Expression, Select, CombiningQuery)):
+                params.extend(operand.params)
+            elif isinstance(operand, (list, tuple)):
+                params.extend(cls._convert(operand))
+            elif isinstance(operand, array):
+                params.extend(operand)
+            else:
+                params.append(operand)
+        return params
 
     def _format(self, operand, param=None):
         par = '({})'.format
@@ -94,16 +94,10 @@ class Operator(Expression):
         raise NotImplemented
 
     def __and__(self, other):
-        if isinstance(other, And):
-            return And([self] + other)
-        else:
-            return And((self, other))
+        return And((self, other))
 
     def __or__(self, other):
-        if isinstance(other, Or):
-            return Or([self] + other)
-        else:
-            return Or((self, other))
+        return Or((self, other))
 
 
 class UnaryOperator(Operator):
@@ -146,13 +140,26 @@ class NaryOperator(list, Operator):
     __slots__ = ()
     _operator = ''
 
+    def _flat(self):
+        "Yield the operands with the nested operators of same type expanded"
+        # Chaining nests the operators so they are expanded without recursion
+        stack = [iter(self)]
+        while stack:
+            for operand in stack[-1]:
+                if type(operand) is type(self):
+                    stack.append(iter(operand))
+                    break
+                yield operand
+            else:
+                stack.pop()
+
     @property
     def _operands(self):
-        return self
+        return tuple(self._flat())
 
     def __str__(self):
         return '(' + (' {} '.format(self._operator)).join(
-            map(text_type, self)) + ')'
+            map(text_type, self._operands)) + ')'
 
 
 class And(NaryOperator):
@@ -354,15 +361,97 @@ class NotILike(ILike):
         return 'NOT ILIKE' if Flavor.get().ilike else 'NOT LIKE'
 
 
+def _bucket(length, buckets):
+    "Return the size of the bucket for length values"
+    if buckets is True:
+        size = 1
+        while size < length:
+            size *= 2
+        return size
+    for size in sorted(buckets):
+        if size >= length:
+            return size
+    return length
+
+
 # TODO SIMILAR
 class In(BinaryOperator):
     __slots__ = ()
     _operator = 'IN'
+    _array_operator = '= ANY'
+    _chunk_operator = 'OR'
+
+    @property
+    def _array(self):
+        "Test if the values are sent as a single array parameter"
+        if not Flavor.get().in_array:
+            return False
+        values = self.right
+        if isinstance(values, (list, tuple)):
+            return not isinstance(values, Query) and not any(
+                isinstance(v, Expression) for v in values)
+        return isinstance(values, array) or hasattr(values, '__array__')
+
+    @property
+    def _operands(self):
+        left, right = super(In, self)._operands
+        buckets = Flavor.get().in_buckets
+        if (buckets and right and isinstance(right, (list, tuple, array))
+                and not isinstance(right, Query)):
+            size = _bucket(len(right), buckets)
+            if size > len(right):
+                right = list(right) + [right[-1]] * (size - len(right))
+        return left, right
+
+    @staticmethod
+    def _chunks(values):
+        "Return the values split by the maximum size of the flavor if needed"
+        max_in = Flavor.get().max_in
+        if (max_in and isinstance(values, (list, tuple, array))
+                and not isinstance(values, Query) and len(values) > max_in):
+            return [values[i:i + max_in]
+                    for i in range(0, len(values), max_in)]
+
+    def __str__(self):
+        if self._array:
+            return '({} {}({}))'.format(
+                self._format(self.left), self._array_operator,
+                Flavor.get().param)
+        left, right = self._operands
+        chunks = self._chunks(right)
+        if chunks:
+            left = self._format(left)
+            return '(' + ' {} '.format(self._chunk_operator).join(
+                '({} {} {})'.format(left, self._operator, self._format(c))
+                for c in chunks) + ')'
+        return super(In, self).__str__()
+
+    @property
+    def params(self):
+        if self._array:
+            if isinstance(self.left, Expression):
+                params = list(self.left.params)
+            else:
+                params = [self.left]
+            values = self.right
+            if isinstance(values, tuple):
+                values = list(values)
+            return tuple(params + [values])
+        left, right = self._operands
+        chunks = self._chunks(right)
+        if chunks:
+            params = []
+            for chunk in chunks:
+                params.extend(self._convert((left, chunk)))
+            return tuple(params)
+        return super(In, self).params
 
 
-class NotIn(BinaryOperator):
+class NotIn(In):
     __slots__ = ()
     _operator = 'NOT IN'
+    _array_operator = '!= ALL'
+    _chunk_operator = 'AND'
 
 
 class Exists(UnaryOperator):
@@ -0,0 +1,1208 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011-2016, Cédric Krier
+# Copyright (c) 2011-2016, B2CK
+# Copyright (c) 2016-2016, Victor Uriarte
+# and contributors. See AUTHORS for more details.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Optional rewrites of queries
+
+Each pass takes a query and returns an equivalent query, the given query
+is never modified. Passes only rewrite the patterns they know to be
+safe and leave the rest of the query untouched.
+"""
+
+import datetime
+from array import array
+from copy import copy
+from decimal import Decimal
+
+from sql.core import (
+    Flavor, Query, WithQuery, FromItem, Expression, Table, With, Select,
+    SelectQuery, CombiningQuery, Union, Column, Join, From, Values, As,
+    Literal, Window, For, Lateral)
+from sql.operators import (
+    NaryOperator, And, Or, Not, Equal, Less, Greater, LessEqual,
+    GreaterEqual, In, NotIn, Exists, Any, All, _INVERT)
+from sql.aggregate import Aggregate
+from sql.conditionals import Case, Coalesce
+from sql._compat import integer_types
+
+__all__ = ('in_to_join', 'case_to_join', 'normalize', 'simplify',
+           'is_empty', 'hoist_subqueries', 'push_predicates', 'reduce_sorts',
+           'in_to_exists', 'or_to_union', 'prune_columns', 'eliminate_joins',
+           'deferred_join')
+
+
+def _attributes(obj):
+    "Yield the name and value of the set attributes of obj"
+    seen = set()
+    for cls in type(obj).__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        for name in slots:
+            if name in seen or name in ('__dict__', '__weakref__'):
+                continue
+            seen.add(name)
+            try:
+                # Use the descriptor as FromItem.__getattr__ returns Column
+                yield name, cls.__dict__[name].__get__(obj, cls)
+            except AttributeError:
+                pass
+    for name, value in sorted(getattr(obj, '__dict__', {}).items()):
+        yield name, value
+
+
+def _is_node(obj):
+    return isinstance(obj, (Expression, Query, FromItem, From, Window, For))
+
+
+def _key(obj):
+    """Return a hashable key of obj equal for structurally identical objects
+
+    Tables and With are compared by identity as each instance is a distinct
+    alias."""
+    if isinstance(obj, (Table, With)):
+        return ('id', id(obj))
+    elif _is_node(obj):
+        if isinstance(obj, NaryOperator):
+            items = tuple(_key(i) for i in obj._flat())
+        elif isinstance(obj, list):
+            items = tuple(_key(i) for i in obj)
+        else:
+            items = ()
+        return (type(obj), items) + tuple(
+            (n, _key(v)) for n, v in _attributes(obj))
+    elif isinstance(obj, (list, tuple)):
+        return (type(obj),) + tuple(_key(i) for i in obj)
+    elif isinstance(obj, array):
+        return (array, obj.typecode, tuple(obj))
+    try:
+        hash(obj)
+    except TypeError:
+        return ('id', id(obj))
+    return (type(obj), obj)
+
+
+def _children(node):
+    "Yield the child nodes of node"
+    if isinstance(node, NaryOperator):
+        items = node._operands
+    elif isinstance(node, (list, tuple)):
+        items = node
+    else:
+        items = ()
+    if _is_node(node):
+        items = list(items) + [v for _, v in _attributes(node)]
+    for item in items:
+        if _is_node(item) or isinstance(item, (list, tuple)):
+            yield item
+
+
+def _transform(node, replace, parent=None, memo=None):
+    """Return node with its descendants rewritten by replace
+
+    replace(node, parent) returns the replacement of node or None to keep
+    it. The nodes are copied only if one of their children is replaced and
+    the With are not entered."""
+    if memo is None:
+        memo = {}
+    new = replace(node, parent)
+    if new is not None:
+        return new
+    elif id(node) in memo:
+        return memo[id(node)]
+    elif isinstance(node, With) or not (
+            _is_node(node) or isinstance(node, (list, tuple))):
+        return node
+    result = node
+    if isinstance(node, (list, tuple)):
+        items = node._operands if isinstance(node, NaryOperator) else node
+        new_items = [_transform(i, replace, node, memo) for i in items]
+        if (len(items) != len(node)
+                or any(a is not b for a, b in zip(new_items, node))):
+            if _is_node(node):
+                result = copy(node)
+                result[:] = new_items
+            else:
+                result = type(node)(new_items)
+    if _is_node(node):
+        for name, value in _attributes(node):
+            if not (_is_node(value) or isinstance(value, (list, tuple))):
+                continue
+            new = _transform(value, replace, node, memo)
+            if new is not value:
+                if result is node:
+                    result = copy(node)
+                setattr(result, name, new)
+    memo[id(node)] = result
+    return result
+
+
+def _conjuncts(where):
+    "Return the list of the conditions of where"
+    if where is None:
+        return []
+    elif isinstance(where, And):
+        return list(where._flat())
+    return [where]
+
+
+def _conjunction(conditions):
+    "Return the condition of all conditions"
+    if not conditions:
+        return None
+    elif len(conditions) == 1:
+        return conditions[0]
+    return And(conditions)
+
+
+def _contains(from_item, table):
+    "Test if the from_item is or joins table"
+    if from_item is table:
+        return True
+    elif isinstance(from_item, Join):
+        return (_contains(from_item.left, table)
+                or _contains(from_item.right, table))
+    return False
+
+
+def _join(from_, table, right, condition, type_='INNER'):
+    """Return a copy of from_ with right joined on the item containing table
+    or None if there is no such item"""
+    for i, from_item in enumerate(from_):
+        if _contains(from_item, table):
+            from_ = From(from_)
+            from_[i] = Join(from_item, right, type_=type_,
+                            condition=condition)
+            return from_
+
+
+def _distinct(values):
+    "Return the values without duplicates and NULL in the same order"
+    seen = set()
+    result = []
+    for value in values:
+        if value is not None and value not in seen:
+            seen.add(value)
+            result.append(value)
+    return result
+
+
+def in_to_join(query, threshold=None):
+    """Rewrite the IN list conditions of the where clause of query with more
+    than threshold values into a join against a VALUES
+
+    The default threshold is the in_join_threshold of the flavor, no
+    condition is rewritten if it is None.
+    """
+    if threshold is None:
+        threshold = Flavor.get().in_join_threshold
+    if (threshold is None or not hasattr(query, 'from_')
+            or not query.columns or not query.from_):
+        return query
+    from_ = query.from_
+    conditions = []
+    for condition in _conjuncts(query.where):
+        values = getattr(condition, 'right', None)
+        if (type(condition) is In
+                and isinstance(condition.left, Column)
+                and isinstance(values, (list, tuple))
+                and not isinstance(values, Query)
+                and len(values) > threshold):
+            try:
+                values = _distinct(values)
+            except TypeError:
+                values = None
+            if values is not None:
+                column = condition.left
+                values = Values([[v] for v in values], columns=[column.name])
+                joined = _join(from_, column.table, values,
+                               column == Column(values, column.name))
+                if joined is not None:
+                    from_ = joined
+                    continue
+        conditions.append(condition)
+    if from_ is query.from_:
+        return query
+    query = copy(query)
+    query.from_ = from_
+    query.where = _conjunction(conditions)
+    return query
+
+
+def _lookup(case):
+    """Return the column and the list of (key, value) of the Case if it only
+    maps the values of a column to constants"""
+    column, mapping, keys = None, [], set()
+    for cond, result in case.whens:
+        if (type(cond) is not Equal or not isinstance(cond.left, Column)
+                or cond.right is None or isinstance(cond.right, Expression)
+                or isinstance(result, Expression)
+                or (result is None and case.else_ is not None)):
+            return
+        if column is None:
+            column = cond.left
+        elif (cond.left.table is not column.table
+                or cond.left.name != column.name):
+            return
+        try:
+            if cond.right in keys:
+                continue
+            keys.add(cond.right)
+        except TypeError:
+            return
+        mapping.append((cond.right, result))
+    if column is not None:
+        return column, mapping
+
+
+def case_to_join(query, threshold=0):
+    """Rewrite the CASE columns of query which map the values of a column
+    to constants with more than threshold WHEN into a LEFT JOIN against a
+    VALUES of the mapping
+
+    The aggregation queries are not rewritten as the joined value would not
+    be grouped."""
+    if not hasattr(query, 'from_') or not query.from_:
+        return query
+    if getattr(query, 'group_by', None) or _has_aggregate(query.columns):
+        return query
+    from_ = query.from_
+    columns = []
+    for column in query.columns:
+        expression = column.expression if isinstance(column, As) else column
+        lookup = None
+        if isinstance(expression, Case) and len(expression.whens) > threshold:
+            lookup = _lookup(expression)
+        if lookup:
+            key, mapping = lookup
+            values = Values(mapping, columns=['key', 'value'])
+            joined = _join(from_, key.table, values,
+                           key == Column(values, 'key'), type_='LEFT')
+            if joined is not None:
+                from_ = joined
+                value = Column(values, 'value')
+                if expression.else_ is not None:
+                    value = Coalesce(value, expression.else_)
+                expression = value
+                if isinstance(column, As):
+                    column = As(expression, column.output_name)
+                else:
+                    column = expression
+        columns.append(column)
+    if from_ is query.from_:
+        return query
+    query = copy(query)
+    query.from_ = from_
+    query.columns = columns
+    return query
+
+
+def _walk(expression):
+    """Yield the nodes of expression without entering the sub-queries and
+    the from items of the columns"""
+    stack = [expression]
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, Query) and node is not expression:
+            continue
+        children = []
+        if isinstance(node, (list, tuple)):
+            children.extend(node)
+        if _is_node(node) and not isinstance(node, (Column, Query)):
+            children.extend(v for _, v in _attributes(node))
+        stack.extend(c for c in reversed(children)
+                     if _is_node(c) or isinstance(c, (list, tuple)))
+
+
+def _has_aggregate(expressions):
+    "Test if any of the expressions contains an aggregate out of a window"
+    return any(isinstance(n, Aggregate) and n.window is None
+               for e in expressions for n in _walk(e))
+
+
+def _is_literal(expression, value):
+    return isinstance(expression, Literal) and expression.value is value
+
+
+def _normalize(expression):
+    "Return the normalized boolean expression"
+    if type(expression) in (And, Or):
+        cls = type(expression)
+        neutral = cls is And
+        flat = expression._operands
+        operands, keys = [], set()
+        for operand in flat:
+            operand = _normalize(operand)
+            for operand in (operand if type(operand) is cls else [operand]):
+                if _is_literal(operand, neutral):
+                    continue
+                elif _is_literal(operand, not neutral):
+                    return Literal(not neutral)
+                key = _key(operand)
+                if key not in keys:
+                    keys.add(key)
+                    operands.append(operand)
+        if not operands:
+            return Literal(neutral)
+        elif len(operands) == 1:
+            return operands[0]
+        elif (len(flat) == len(expression)
+                and len(operands) == len(flat)
+                and all(a is b for a, b in zip(operands, flat))):
+            return expression
+        return cls(operands)
+    elif type(expression) is Not:
+        operand = _normalize(expression.operand)
+        if type(operand) is Not:
+            return operand.operand
+        elif _is_literal(operand, True) or _is_literal(operand, False):
+            return Literal(not operand.value)
+        elif type(operand) in _INVERT:
+            return _INVERT[type(operand)](operand.left, operand.right)
+        elif operand is not expression.operand:
+            return Not(operand)
+    return expression
+
+
+def normalize(query):
+    """Normalize the boolean conditions of query
+
+    Nested And and Or are flattened, neutral literals removed, absorbing
+    literals short-circuit the condition, duplicated conditions are removed
+    and negations are folded.
+    """
+    changes = {}
+    for name in ('where', 'having'):
+        condition = getattr(query, name, None)
+        if isinstance(condition, Expression):
+            normalized = _normalize(condition)
+            if _is_literal(normalized, True):
+                normalized = None
+            if normalized is not condition:
+                changes[name] = normalized
+    if not changes:
+        return query
+    query = copy(query)
+    for name, value in changes.items():
+        setattr(query, name, value)
+    return query
+
+
+_LOWER = {Greater: False, GreaterEqual: True}
+_UPPER = {Less: False, LessEqual: True}
+# The types whose Python ordering and equality match the SQL ones, unlike
+# the strings compared with the collation of the database
+_ORDERED = integer_types + (float, Decimal, datetime.date)
+
+
+def _column_key(expression):
+    if isinstance(expression, Column):
+        return id(expression.table), expression.name
+
+
+def _is_constant(value):
+    return value is not None and not isinstance(
+        value, (Expression, Query, list, tuple, array))
+
+
+def _merge_or(operands):
+    "Merge the equalities on the same column into IN"
+    groups, merged = {}, []
+    for operand in operands:
+        values = None
+        if _column_key(getattr(operand, 'left', None)):
+            if type(operand) is Equal and _is_constant(operand.right):
+                values = [operand.right]
+            elif (type(operand) is In
+                    and isinstance(operand.right, (list, tuple))
+                    and not isinstance(operand.right, Query)
+                    and all(_is_constant(v) for v in operand.right)):
+                values = list(operand.right)
+        if values is not None:
+            key = _column_key(operand.left)
+            if key in groups:
+                merged[groups[key]][1].extend(values)
+                merged[groups[key]][2] = True
+                continue
+            groups[key] = len(merged)
+        merged.append([operand, values, False])
+    result = []
+    for operand, values, changed in merged:
+        if changed:
+            try:
+                values = _distinct(values)
+            except TypeError:
+                pass
+            operand = In(operand.left, values)
+        result.append(operand)
+    return result
+
+
+def _tighten(comparisons):
+    """Return the tightest comparisons equivalent to the conjunction of
+    comparisons on the same column or None if it is a contradiction"""
+    equal = lower = upper = None
+    for comparison in comparisons:
+        value, type_ = comparison.right, type(comparison)
+        if type_ is Equal:
+            if equal is not None and equal.right != value:
+                return
+            equal = equal or comparison
+        elif type_ in _LOWER:
+            if (lower is None or value > lower.right
+                    or (value == lower.right and not _LOWER[type_])):
+                lower = comparison
+        elif (upper is None or value < upper.right
+                or (value == upper.right and not _UPPER[type_])):
+            upper = comparison
+    if lower is not None and upper is not None:
+        if (lower.right > upper.right
+                or (lower.right == upper.right
+                    and not (_LOWER[type(lower)] and _UPPER[type(upper)]))):
+            return
+    if equal is not None:
+        value = equal.right
+        if lower is not None and (
+                value < lower.right
+                or (value == lower.right and not _LOWER[type(lower)])):
+            return
+        if upper is not None and (
+                value > upper.right
+                or (value == upper.right and not _UPPER[type(upper)])):
+            return
+        return [equal]
+    return [c for c in (lower, upper) if c is not None]
+
+
+def _merge_and(operands):
+    "Merge the comparisons on the same column into the tightest range"
+    types = (Equal,) + tuple(_LOWER) + tuple(_UPPER)
+    groups = {}
+    for i, operand in enumerate(operands):
+        if (type(operand) in types
+                and _column_key(operand.left)
+                and isinstance(operand.right, _ORDERED)):
+            groups.setdefault(_column_key(operand.left), []).append(i)
+    replaced = {}
+    for indices in groups.values():
+        if len(indices) < 2:
+            continue
+        try:
+            tightest = _tighten([operands[i] for i in indices])
+        except TypeError:
+            continue
+        if tightest is None:
+            return [Literal(False)]
+        for i in indices:
+            replaced[i] = []
+        replaced[indices[0]] = tightest
+    result = []
+    for i, operand in enumerate(operands):
+        result.extend(replaced.get(i, [operand]))
+    return result
+
+
+def _simplify(expression):
+    "Return the simplified boolean expression"
+    if type(expression) in (And, Or):
+        flat = expression._operands
+        operands = [_simplify(o) for o in flat]
+        if type(expression) is Or:
+            operands = _merge_or(operands)
+        else:
+            operands = _merge_and(operands)
+        if (len(flat) != len(expression)
+                or len(operands) != len(flat)
+                or any(a is not b for a, b in zip(operands, flat))):
+            expression = _normalize(type(expression)(operands))
+    return expression
+
+
+def simplify(query):
+    """Simplify the boolean conditions of query
+
+    The conditions are normalized, the equalities on the same column in a
+    disjunction are merged into an IN and the comparisons on the same
+    column in a conjunction with numbers or dates are merged into the
+    tightest range. A contradiction is replaced by Literal(False).
+    """
+    query = normalize(query)
+    changes = {}
+    for name in ('where', 'having'):
+        condition = getattr(query, name, None)
+        if isinstance(condition, Expression):
+            simplified = _simplify(condition)
+            if simplified is not condition:
+                changes[name] = simplified
+    if not changes:
+        return query
+    query = copy(query)
+    for name, value in changes.items():
+        setattr(query, name, value)
+    return query
+
+
+def is_empty(query):
+    "Test if the simplified conditions of query can not match any row"
+    query = simplify(query)
+    if _is_literal(getattr(query, 'having', None), False):
+        return True
+    if _is_literal(getattr(query, 'where', None), False):
+        return not (isinstance(query, Select) and not query.group_by
+                    and _has_aggregate(query.columns))
+    return False
+
+
+def _is_subquery(node):
+    return isinstance(node, (Select, CombiningQuery))
+
+
+def _is_correlated(query):
+    "Test if query references columns of from items defined outside of it"
+    defined, referenced = set(), {}
+    stack = [query]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Column):
+            referenced[id(node.table)] = node.table
+            continue
+        elif isinstance(node, (From, Join, Lateral)):
+            items = list(node) if isinstance(node, From) else [node]
+            while items:
+                item = items.pop()
+                defined.add(id(item))
+                if isinstance(item, Join):
+                    items.extend((item.left, item.right))
+                elif isinstance(item, Lateral):
+                    items.append(item._from_item)
+        elif isinstance(node, SelectQuery) and node.with_:
+            defined.update(id(w) for w in node.with_)
+        stack.extend(_children(node))
+    return any(i not in defined and not isinstance(t, With)
+               for i, t in referenced.items())
+
+
+def _subqueries(node, counts, order):
+    """Count the occurrences of the subqueries under node by structural key
+
+    The repeated subqueries are entered only once and the keys are
+    appended to order after the keys of their own subqueries."""
+    for child in _children(node):
+        if isinstance(child, (Column, With, Lateral, Values)):
+            continue
+        elif _is_subquery(child):
+            key = _key(child)
+            counts[key] = counts.get(key, 0) + 1
+            if counts[key] > 1:
+                continue
+            _subqueries(child, counts, order)
+            order.append((key, child))
+        else:
+            _subqueries(child, counts, order)
+
+
+def hoist_subqueries(query):
+    """Hoist the structurally identical subqueries repeated in query into
+    With appended to its with_
+
+    The occurrences in FROM reference the With and the others select from
+    it. As a With has a single alias, the other subquery objects of FROM
+    equal to the first one are replaced by a distinct selection from it.
+    Correlated subqueries are kept in place and the With of query are not
+    rewritten."""
+    if not isinstance(query, WithQuery):
+        return query
+    counts, order = {}, []
+    _subqueries(query, counts, order)
+    withs = {}
+    for key, subquery in order:
+        if counts[key] > 1 and not _is_correlated(subquery):
+            withs[key] = (With(), subquery)
+    if not withs:
+        return query
+
+    def replace(node, parent):
+        if node is not root and _is_subquery(node):
+            with_, _ = withs.get(_key(node), (None, None))
+            if with_ is None:
+                return
+            elif isinstance(parent, (From, Join, Column)):
+                if id(node) not in items:
+                    if any(i is with_ for i in items.values()):
+                        items[id(node)] = with_.select()
+                    else:
+                        items[id(node)] = with_
+                return items[id(node)]
+            return with_.select()
+
+    for with_, subquery in withs.values():
+        root, items = subquery, {}
+        with_.query = _transform(subquery, replace)
+    root, items = query, {}
+    query = _transform(query, replace)
+    if query is root:
+        query = copy(query)
+    query.with_ = list(query.with_ or []) + [
+        withs[k][0] for k, _ in order if k in withs]
+    return query
+
+
+def _outputs(query, names=()):
+    """Return a dictionary of the output names of the Select query to their
+    expression or None if they can not be known
+
+    names are the column names of a With which rename the outputs."""
+    if not query.columns:
+        if names or len(query.from_) != 1 or not isinstance(
+                query.from_[0], Table):
+            return
+        table = query.from_[0]
+        return _AnyColumn(table)
+    outputs = {}
+    for i, column in enumerate(query.columns):
+        if i < len(names):
+            name = names[i]
+        elif isinstance(column, As):
+            name = column.output_name
+        elif isinstance(column, Column) and column.name != '*':
+            name = column.name
+        else:
+            continue
+        if isinstance(column, As):
+            column = column.expression
+        if isinstance(column, Column) and column.name == '*':
+            return
+        outputs[name] = column
+    return outputs
+
+
+class _AnyColumn(object):
+    "Map any name to the column of the table"
+    __slots__ = ('table',)
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, name):
+        return Column(self.table, name)
+
+
+def _is_pushable(query):
+    "Test if conditions can be pushed into the where of the query"
+    return (type(query) is Select and query.from_
+            and query.limit is None and query.offset is None
+            and not query.group_by and query.having is None
+            and not any(isinstance(n, (Aggregate, Window))
+                        for c in query.columns for n in _walk(c)))
+
+
+def _references(query, with_):
+    "Return the number of from items of query and its With which are with_"
+    count, seen, stack = 0, set(), [query]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (From, Join)):
+            items = node if isinstance(node, From) else (node.left, node.right)
+            count += sum(1 for i in items if i is with_)
+        elif isinstance(node, With):
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+        elif isinstance(node, Column):
+            continue
+        stack.extend(_children(node))
+    return count
+
+
+def _push(condition, from_item, outputs):
+    """Return the condition rewritten on the outputs if it only references
+    the columns of from_item or None"""
+    columns = []
+    for node in _walk(condition):
+        if isinstance(node, Query):
+            return
+        elif isinstance(node, Column):
+            if node.table is not from_item or outputs.get(node.name) is None:
+                return
+            columns.append(node)
+    if not columns:
+        return
+
+    def replace(node, parent):
+        if isinstance(node, Column) and node.table is from_item:
+            return outputs.get(node.name)
+    return _transform(condition, replace)
+
+
+def push_predicates(query):
+    """Push the conditions of the where of the Select query which only
+    reference the columns of a subquery or a With of its FROM into the
+    where of that subquery
+
+    The subqueries with LIMIT, OFFSET, GROUP BY, HAVING, aggregate or
+    window are not changed. A With must not be recursive and must be used
+    only once in query.
+    """
+    if type(query) is not Select or not query.from_ or query.where is None:
+        return query
+    conditions = _conjuncts(query.where)
+    replaced = {}
+    for from_item in query.from_:
+        if isinstance(from_item, With):
+            if (from_item.recursive or from_item not in (query.with_ or [])
+                    or _references(query, from_item) != 1):
+                continue
+            subquery, names = from_item.query, from_item.columns
+        else:
+            subquery, names = from_item, ()
+        if not _is_pushable(subquery):
+            continue
+        outputs = _outputs(subquery, names)
+        if outputs is None:
+            continue
+        pushed, kept = [], []
+        for condition in conditions:
+            condition_ = _push(condition, from_item, outputs)
+            if condition_ is None:
+                kept.append(condition)
+            else:
+                pushed.append(condition_)
+        if not pushed:
+            continue
+        conditions = kept
+        subquery = copy(subquery)
+        subquery.where = _conjunction(_conjuncts(subquery.where) + pushed)
+        subquery = push_predicates(subquery)
+        if isinstance(from_item, With):
+            new = copy(from_item)
+            new.query = subquery
+        else:
+            new = subquery
+        replaced[id(from_item)] = new
+    if not replaced:
+        return query
+
+    def replace(node, parent):
+        return replaced.get(id(node))
+    query = copy(query)
+    query.where = _conjunction(conditions)
+    return _transform(query, replace)
+
+
+def _is_aggregation(query):
+    "Test if the Select query only returns aggregates of its rows"
+    if not query.columns:
+        return False
+    for column in query.columns:
+        if isinstance(column, As):
+            column = column.expression
+        if not isinstance(column, Aggregate) or column.window is not None:
+            return False
+    return True
+
+
+def _from_items(from_):
+    "Yield the items of from_ and of its joins"
+    items = list(reversed(from_))
+    while items:
+        item = items.pop()
+        if isinstance(item, Join):
+            items.extend((item.right, item.left))
+        else:
+            yield item
+
+
+def _reduce_sorts(query, unordered):
+    if (unordered and query.order_by
+            and query.limit is None and query.offset is None):
+        query = copy(query)
+        query.order_by = None
+    if isinstance(query, CombiningQuery):
+        queries = [_reduce_sorts(q, True) if _is_subquery(q) else q
+                   for q in query.queries]
+        if (type(query) is Union and query.all_ and not query.order_by
+                and query.limit is not None):
+            limit = query.limit + (query.offset or 0)
+            for i, branch in enumerate(queries):
+                if (isinstance(branch, SelectQuery)
+                        and (branch.limit is None or branch.limit > limit)):
+                    # The branch is wrapped as LIMIT must be last
+                    branch = copy(branch)
+                    branch.limit = limit
+                    queries[i] = branch.select()
+        if any(a is not b for a, b in zip(queries, query.queries)):
+            query = copy(query)
+            query.queries = tuple(queries)
+        return query
+    elif not isinstance(query, Select):
+        return query
+
+    replaced = {}
+    if query.from_:
+        unordered = bool(query.order_by) or _is_aggregation(query)
+        for item in _from_items(query.from_):
+            if _is_subquery(item):
+                replaced[id(item)] = _reduce_sorts(item, unordered)
+
+    def replace(node, parent):
+        if id(node) in replaced:
+            return replaced[id(node)]
+        elif node is not query and _is_subquery(node):
+            unordered = (isinstance(parent, In) and node is parent.right
+                         or isinstance(parent, (Exists, Any, All)))
+            replaced[id(node)] = _reduce_sorts(node, unordered)
+            return replaced[id(node)]
+    return _transform(query, replace)
+
+
+def reduce_sorts(query):
+    """Push the LIMIT of query into the branches of UNION ALL and remove
+    the ORDER BY which does not change the result
+
+    The ORDER BY without LIMIT nor OFFSET is removed from the subqueries of
+    IN, EXISTS, ANY and ALL, from the branches of combining queries and
+    from the subqueries of the FROM of a query which is ordered or which
+    only selects aggregates.
+    """
+    return _reduce_sorts(query, False)
+
+
+def _exists(in_, not_null, outer):
+    """Return the EXISTS equivalent to the IN subquery condition of a where
+    or None if it is not safe
+
+    outer is the set of the ids of the from items of the query."""
+    subquery = in_.right
+    if (type(subquery) is not Select or len(subquery.columns or ()) != 1
+            or subquery.limit is not None or subquery.offset is not None
+            or subquery.group_by or subquery.having is not None
+            or _has_aggregate(subquery.columns)
+            or any(isinstance(n, Window)
+                   for n in _walk(subquery.columns[0]))):
+        return
+    # The same from item has the same alias inside and outside so the
+    # correlation condition would only reference the inner one
+    if any(id(i) in outer for i in _from_items(subquery.from_ or ())):
+        return
+    expression = subquery.columns[0]
+    if isinstance(expression, As):
+        expression = expression.expression
+    if type(in_) is NotIn:
+        # NOT IN is NULL when a side is NULL while NOT EXISTS is true
+        if (_column_key(in_.left) not in not_null
+                or _column_key(expression) not in not_null):
+            return
+    subquery = copy(subquery)
+    subquery.where = _conjunction(
+        _conjuncts(subquery.where) + [expression == in_.left])
+    subquery.order_by = None
+    if type(in_) is NotIn:
+        return Not(Exists(subquery))
+    return Exists(subquery)
+
+
+def in_to_exists(query, not_null=()):
+    """Rewrite the IN and NOT IN subquery conditions of the where clause of
+    the Select query into correlated EXISTS and NOT EXISTS if the in_exists
+    of the flavor is set
+
+    IN is rewritten only as a condition of the where where NULL and false
+    filter the same. NOT IN is rewritten only if both its column and the
+    column of the subquery are in not_null, the columns which can not be
+    NULL.
+    """
+    # The columns of Update and Delete are not qualified by an alias so
+    # they can not be referenced from a correlated subquery
+    if (not Flavor.get().in_exists or not isinstance(query, Select)
+            or not isinstance(query.where, Expression)):
+        return query
+    not_null = set(_column_key(c) for c in not_null)
+    not_null.discard(None)
+    outer = set(id(i) for i in _from_items(query.from_ or ()))
+    conditions, changed = [], False
+    for condition in _conjuncts(query.where):
+        if (type(condition) in (In, NotIn)
+                and isinstance(condition.right, Query)):
+            exists = _exists(condition, not_null, outer)
+            if exists is not None:
+                condition, changed = exists, True
+        conditions.append(condition)
+    if not changed:
+        return query
+    query = copy(query)
+    query.where = _conjunction(conditions)
+    return query
+
+
+def or_to_union(query, distinct=False):
+    """Rewrite the Select query with a disjunction in its where into a
+    UNION of a query per condition of the disjunction
+
+    If distinct is set the rows of the branches are merged by UNION, which
+    also removes the duplicated rows of query. Otherwise the branches are
+    merged by UNION ALL and each excludes the rows of the previous ones.
+    Queries with GROUP BY, HAVING, aggregate, window, ORDER BY, LIMIT,
+    OFFSET, FOR or WITH are not rewritten.
+    """
+    if (type(query) is not Select or query.where is None
+            or query.group_by or query.having is not None
+            or query.order_by or query.limit is not None
+            or query.offset is not None or query.for_ or query.with_
+            or any(isinstance(n, (Aggregate, Window))
+                   for c in query.columns for n in _walk(c))):
+        return query
+    conditions = _conjuncts(query.where)
+    for i, condition in enumerate(conditions):
+        if type(condition) is Or:
+            break
+    else:
+        return query
+    common = conditions[:i] + conditions[i + 1:]
+    branches, previous = [], []
+    for condition in condition._operands:
+        branch = copy(query)
+        excluded = [] if distinct else [
+            Not(Coalesce(p, Literal(False))) for p in previous]
+        branch.where = _conjunction(common + [condition] + excluded)
+        branches.append(branch)
+        previous.append(condition)
+    return Union(*branches, all_=not distinct)
+
+
+def _output_name(column):
+    if isinstance(column, As):
+        return column.output_name
+    elif isinstance(column, Column) and column.name != '*':
+        return column.name
+
+
+def _referenced(query):
+    """Return a dictionary of the ids of the from items to the list of
+    their column names referenced in query"""
+    referenced, seen, stack = {}, set(), [query]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if isinstance(node, Column):
+            names = referenced.setdefault(id(node.table), [])
+            if node.name not in names:
+                names.append(node.name)
+            continue
+        stack.extend(reversed(list(_children(node))))
+    return referenced
+
+
+def _is_ordered_by_position(query):
+    return any(isinstance(n, Literal) and isinstance(n.value, integer_types)
+               for o in query.order_by or () for n in _walk(o))
+
+
+def _prune(query, names):
+    """Return the subquery with only the columns of names or None if it can
+    not be pruned"""
+    if '*' in names or _is_ordered_by_position(query):
+        return
+    if isinstance(query, Select):
+        if query.columns:
+            keep = [i for i, c in enumerate(query.columns)
+                    if _output_name(c) in names]
+            return _prune_positions([query], keep)
+        elif (names and len(query.from_ or ()) == 1
+                and isinstance(query.from_[0], Table)):
+            query = copy(query)
+            query.columns = [Column(query.from_[0], n) for n in names]
+            return query
+    elif (type(query) is Union and query.all_
+            and all(isinstance(q, Select) and q.columns
+                    for q in query.queries)
+            and len(set(len(q.columns) for q in query.queries)) == 1
+            and not any(map(_is_ordered_by_position, query.queries))):
+        # The branches are merged by position and named by the first one
+        keep = [i for i, c in enumerate(query.queries[0].columns)
+                if _output_name(c) in names]
+        queries = _prune_positions(query.queries, keep)
+        if queries is not None:
+            query = copy(query)
+            query.queries = tuple(queries)
+            return query
+
+
+def _prune_positions(queries, keep):
+    """Return the Select queries with only the columns at the keep positions
+    or None if they are unchanged"""
+    if len(keep) == len(queries[0].columns):
+        return
+    # Keep a column for the row to still be returned
+    keep = keep or [0]
+    result = []
+    for query in queries:
+        query = copy(query)
+        query.columns = [query.columns[i] for i in keep]
+        result.append(query)
+    return result if len(result) > 1 else result[0]
+
+
+def prune_columns(query):
+    """Remove from the subqueries of the FROM of the Select query the columns
+    which are not referenced by query
+
+    A subquery selecting * from a single table selects only the referenced
+    columns. The positions of the columns not referenced are removed from
+    all the branches of a UNION ALL while other combining queries are kept
+    as their rows depend on all the columns. The pruning is applied to the
+    nested subqueries.
+    """
+    if isinstance(query, CombiningQuery):
+        queries = tuple(prune_columns(q) for q in query.queries)
+        if any(a is not b for a, b in zip(queries, query.queries)):
+            query = copy(query)
+            query.queries = queries
+        return query
+    elif type(query) is not Select or not query.from_:
+        return query
+    referenced = _referenced(query) if query.columns else {}
+    replaced = {}
+    for item in _from_items(query.from_):
+        if not _is_subquery(item):
+            continue
+        pruned = None
+        if query.columns:
+            pruned = _prune(item, referenced.get(id(item), []))
+        pruned = prune_columns(pruned or item)
+        if pruned is not item:
+            replaced[id(item)] = pruned
+    if not replaced:
+        return query
+
+    def replace(node, parent):
+        return replaced.get(id(node))
+    return _transform(query, replace)
+
+
+def _count_columns(node, table):
+    "Return the number of columns of table in node"
+    count, stack = 0, [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Column):
+            count += node.table is table
+        else:
+            stack.extend(_children(node))
+    return count
+
+
+def _is_unique_join(join):
+    "Test if the right Table of join matches at most one row by a key"
+    table = join.right
+    if not isinstance(table, Table) or not table._keys:
+        return False
+    names = set()
+    for condition in _conjuncts(join.condition):
+        if type(condition) is not Equal:
+            continue
+        for column, other in [
+                (condition.left, condition.right),
+                (condition.right, condition.left)]:
+            if (isinstance(column, Column) and column.table is table
+                    and other is not None
+                    and not _count_columns(other, table)):
+                names.add(column.name)
+    return any(names.issuperset(k) for k in table._keys)
+
+
+def eliminate_joins(query):
+    """Remove from the Select query the LEFT JOIN of a table on one of its
+    keys when none of the columns of the table are used outside of the join
+    condition
+
+    Such a join returns each row of its left side exactly once so it does
+    not change the result. The pass is applied to the subqueries.
+    """
+    if type(query) is not Select or not query.from_:
+        return query
+
+    def eliminate(item):
+        if not isinstance(item, Join):
+            return item
+        left = eliminate(item.left)
+        if (item.type_ in ('LEFT', 'LEFT OUTER') and _is_unique_join(item)
+                and _count_columns(query, item.right)
+                == _count_columns(item.condition, item.right)):
+            return left
+        if left is not item.left:
+            item = copy(item)
+            item.left = left
+        return item
+    # Removing a join may leave the tables of its condition unused
+    # and the columns of the joined tables are selected by *
+    while query.columns:
+        from_ = From(eliminate(i) for i in query.from_)
+        if all(a is b for a, b in zip(from_, query.from_)):
+            break
+        query = copy(query)
+        query.from_ = from_
+
+    def replace(node, parent):
+        if node is not query and type(node) is Select:
+            return eliminate_joins(node)
+    return _transform(query, replace)
+
+
+def deferred_join(query):
+    """Rewrite the paginated Select query on a table with a key to select
+    first the key of the page rows and then join the table on it
+
+    The ORDER BY, LIMIT and OFFSET are applied to a subquery selecting only
+    the columns of the first key of the table so the server does not read
+    the full rows skipped by the offset. The query must select from a
+    single table with keys and have an ORDER BY, a LIMIT and an OFFSET.
+    The columns must be explicit as * would select those of the page too.
+    """
+    if (type(query) is not Select or not query.columns
+            or len(query.from_ or ()) != 1
+            or not isinstance(query.from_[0], Table)
+            or not query.from_[0]._keys
+            or not query.order_by or query.limit is None or not query.offset
+            or query.group_by or query.having is not None or query.for_
+            or any(isinstance(n, (Aggregate, Window))
+                   for c in query.columns for n in _walk(c))):
+        return query
+    table = query.from_[0]
+    key = [Column(table, n) for n in table._keys[0]]
+    page = table.select(*key, where=query.where, order_by=query.order_by,
+                        limit=query.limit, offset=query.offset)
+    condition = _conjunction([k == Column(page, k.name) for k in key])
+    query = copy(query)
+    query.from_ = From([Join(table, page, condition=condition)])
+    query.where = None
+    query.limit = query.offset = None
+    return query
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011-2016, Cédric Krier
+# Copyright (c) 2011-2016, B2CK
+# Copyright (c) 2016-2016, Victor Uriarte
+# and contributors. See AUTHORS for more details.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+from sql import Flavor, Table, Conflict, NotIn
+from sql.bulk import insert_many, update_many, batches, split_in, stage
+
+
+def test_update_many(table):
+    queries = list(update_many(table, table.id, [table.c1, table.c2],
+                               [(1, ['foo', 'bar']), (2, ['spam', 'eggs'])]))
+    assert len(queries) == 1
+    query, = queries
+    assert str(query) == ('UPDATE "t" AS "b" SET "c1" = "a"."c1", '
+                          '"c2" = "a"."c2" '
+                          'FROM (VALUES (%s, %s, %s), (%s, %s, %s)) '
+                          'AS "a" ("id", "c1", "c2") '
+                          'WHERE ("b"."id" = "a"."id")')
+    assert query.params == (1, 'foo', 'bar', 2, 'spam', 'eggs')
+
+
+def test_update_many_composite_key(table):
+    query, = update_many(table, [table.k1, table.k2], [table.c],
+                         [((1, 2), ['foo'])])
+    assert str(query) == ('UPDATE "t" AS "b" SET "c" = "a"."c" '
+                          'FROM (VALUES (%s, %s, %s)) '
+                          'AS "a" ("k1", "k2", "c") '
+                          'WHERE (("b"."k1" = "a"."k1") '
+                          'AND ("b"."k2" = "a"."k2"))')
+    assert query.params == (1, 2, 'foo')
+
+
+def test_update_many_chunked(table):
+    try:
+        Flavor.set(Flavor(max_params=5))
+        queries = list(update_many(table, table.id, [table.c],
+                                   [(i, [str(i)]) for i in range(5)]))
+        assert [q.params for q in queries] == [
+            (0, '0', 1, '1'), (2, '2', 3, '3'), (4, '4')]
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_update_many_case(table):
+    try:
+        Flavor.set(Flavor(update_from=False, max_params=7))
+        queries = list(update_many(table, table.id, [table.c],
+                                   [(1, ['foo']), (2, ['bar']),
+                                    (3, ['baz'])]))
+        assert len(queries) == 2
+        assert str(queries[0]) == (
+            'UPDATE "t" SET "c" = CASE WHEN ("t"."id" = %s) THEN %s '
+            'WHEN ("t"."id" = %s) THEN %s ELSE "t"."c" END '
+            'WHERE ("t"."id" IN (%s, %s))')
+        assert queries[0].params == (1, 'foo', 2, 'bar', 1, 2)
+        assert queries[1].params == (3, 'baz', 3)
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_insert_many(table):
+    try:
+        Flavor.set(Flavor(max_params=4))
+        queries = list(insert_many(table, [table.id, table.c],
+                                   [(i, str(i)) for i in range(3)],
+                                   on_conflict=Conflict(table.id)))
+        assert [str(q) for q in queries] == [
+            'INSERT INTO "t" ("id", "c") VALUES (%s, %s), (%s, %s) '
+            'ON CONFLICT ("id") DO UPDATE SET "c" = EXCLUDED."c"',
+            'INSERT INTO "t" ("id", "c") VALUES (%s, %s) '
+            'ON CONFLICT ("id") DO UPDATE SET "c" = EXCLUDED."c"']
+        assert [q.params for q in queries] == [
+            (0, '0', 1, '1'), (2, '2')]
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_batches_delete(table):
+    query = table.delete(where=table.c == 'foo')
+    batches_ = batches(query, table.id, size=100)
+    batch = next(batches_)
+    assert str(batch) == ('DELETE FROM "t" WHERE ("id" IN ('
+                          'SELECT "id" FROM "t" WHERE ("c" = %s) '
+                          'ORDER BY "id" LIMIT 100))')
+    assert batch.params == ('foo',)
+
+    batch = batches_.send(42)
+    assert str(batch) == ('DELETE FROM "t" WHERE ("id" IN ('
+                          'SELECT "id" FROM "t" '
+                          'WHERE (("c" = %s) AND ("id" > %s)) '
+                          'ORDER BY "id" LIMIT 100))')
+    assert batch.params == ('foo', 42)
+    assert next(batches_).params == ('foo', 42)
+    assert str(query) == 'DELETE FROM "t" WHERE ("c" = %s)'
+
+
+def test_batches_update(table):
+    query = table.update([table.c], ['foo'])
+    batch = next(batches(query, table.id, size=10))
+    assert str(batch) == ('UPDATE "t" SET "c" = %s WHERE ("t"."id" IN ('
+                          'SELECT "t"."id" FROM "t" AS "t" '
+                          'ORDER BY "t"."id" LIMIT 10))')
+    assert batch.params == ('foo',)
+
+
+def test_batches_in_limit(table):
+    query = table.delete(where=table.c == 'foo')
+    try:
+        Flavor.set(Flavor(in_limit=False))
+        batch = next(batches(query, table.id, size=100))
+        assert str(batch) == (
+            'DELETE FROM "t" WHERE ("id" IN (SELECT "a"."id" FROM ('
+            'SELECT "id" FROM "t" WHERE ("c" = %s) '
+            'ORDER BY "id" LIMIT 100) AS "a"))')
+        assert batch.params == ('foo',)
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_batches_update_from(table):
+    other = Table('o')
+    query = table.update(
+        [table.c], [other.c], from_=[other],
+        where=(table.id == other.id) & (other.d == 'foo'))
+    batch = next(batches(query, table.id, size=10))
+    assert str(batch) == (
+        'UPDATE "t" AS "b" SET "c" = "a"."c" FROM "o" AS "a" '
+        'WHERE (("b"."id" = "a"."id") AND ("a"."d" = %s) '
+        'AND ("b"."id" IN ('
+        'SELECT "b"."id" FROM "t" AS "b", "o" AS "a" '
+        'WHERE (("b"."id" = "a"."id") AND ("a"."d" = %s)) '
+        'ORDER BY "b"."id" LIMIT 10)))')
+    assert batch.params == ('foo', 'foo')
+
+
+def test_split_in(table):
+    in_ = table.c.in_([1, 2, 3])
+    query = table.select(where=(table.d == 'foo') & in_)
+    try:
+        Flavor.set(Flavor(max_params=3))
+        queries = list(split_in(query, in_))
+        assert [str(q) for q in queries] == [
+            'SELECT * FROM "t" AS "a" WHERE (("a"."d" = %s) '
+            'AND ("a"."c" IN (%s, %s)))',
+            'SELECT * FROM "t" AS "a" WHERE (("a"."d" = %s) '
+            'AND ("a"."c" IN (%s)))']
+        assert [q.params for q in queries] == [('foo', 1, 2), ('foo', 3)]
+    finally:
+        Flavor.set(Flavor())
+
+    queries = list(split_in(table.select(where=in_), in_, size=1))
+    assert [q.params for q in queries] == [(1,), (2,), (3,)]
+
+    with pytest.raises(ValueError):
+        list(split_in(query, NotIn(table.c, [1])))
+
+
+def test_stage(table):
+    query = table.select(table.c, where=table.d == 'foo')
+    try:
+        Flavor.set(Flavor(max_params=2))
+        steps = stage(query, table.id, [1, 2, 2, 3])
+    finally:
+        Flavor.set(Flavor())
+    assert steps == [
+        ('CREATE TEMPORARY TABLE "staged_keys" ("id" BIGINT)', ()),
+        ('INSERT INTO "staged_keys" ("id") VALUES (%s), (%s)', (1, 2)),
+        ('INSERT INTO "staged_keys" ("id") VALUES (%s)', (3,)),
+        ('SELECT "a"."c" FROM "t" AS "a" '
+         'INNER JOIN "staged_keys" AS "b" ON ("a"."id" = "b"."id") '
+         'WHERE ("a"."d" = %s)', ('foo',)),
+        ('DROP TABLE "staged_keys"', ())]
+    assert str(query) == 'SELECT "a"."c" FROM "t" AS "a" WHERE ("a"."d" = %s)'
+
+
+def test_stage_copy(table, t2):
+    steps = stage(table.select(), table.id, [1, 2], type_='INTEGER',
+                  name='ids', copy_=True)
+    assert steps[0] == ('CREATE TEMPORARY TABLE "ids" ("id" INTEGER)', ())
+    sql, buffer_ = steps[1]
+    assert sql == 'COPY "ids" ("id") FROM STDIN'
+    assert buffer_.read() == b'1\n2\n'
+
+    with pytest.raises(ValueError):
+        stage(table.select(), t2.id, [1])
@@ -29,7 +29,7 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from sql import Union
+from sql import Table, Union, Intersect, Except, Literal
 
 
 def test_two_query_union(query1, query2):
@@ -68,3 +68,39 @@ def test_three_query_union(query1, query2, query3):
                           'SELECT * FROM "t2" AS "b" UNION '
                           'SELECT * FROM "t3" AS "c"')
     assert query.params == ()
+
+
+def test_chaining_flattened(query1, query2, query3):
+    for query, cls in [
+            (query1 | query2 | query3, Union),
+            (query1 | (query2 | query3), Union),
+            (query1 & query2 & query3, Intersect),
+            (query1 - query2 - query3, Except)]:
+        assert type(query) is cls
+        assert query.queries == (query1, query2, query3)
+
+    query = query1 - (query2 - query3)
+    assert query.queries[0] is query1
+    assert type(query.queries[1]) is Except
+
+
+def test_chaining_incompatible(query1, query2, query3):
+    union = query1 | query2
+    union.all_ = True
+    assert (union | query3).queries == (union, query3)
+
+    union = query1 | query2
+    union.order_by = Literal(1)
+    assert (union | query3).queries == (union, query3)
+
+    assert ((query1 | query2) & query3).queries[1] is query3
+
+
+def test_chaining_many():
+    query = Table('t0').select()
+    for i in range(1, 500):
+        query = query | Table('t%s' % i).select()
+    assert len(query.queries) == 500
+    sql = str(query)
+    assert sql.count(' UNION ') == 499
+    assert sql.startswith('SELECT * FROM "t0" AS "a" UNION ')
@@ -54,6 +54,13 @@ def test_case_no_expression(table):
     assert case.params == (True, False, False)
 
 
+def test_case_many_whens(table):
+    case = Case(*[(table.c == i, i) for i in range(10000)])
+    assert str(case) == 'CASE ' + ' '.join(
+        ['WHEN ("c" = %s) THEN %s'] * 10000) + ' END'
+    assert len(case.params) == 20000
+
+
 def test_coalesce(table):
     coalesce = Coalesce(table.c1, table.c2, 'foo')
     assert str(coalesce) == 'COALESCE("c1", "c2", %s)'
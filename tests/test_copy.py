@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011-2016, Cédric Krier
+# Copyright (c) 2011-2016, B2CK
+# Copyright (c) 2016-2016, Victor Uriarte
+# and contributors. See AUTHORS for more details.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import csv
+import io
+import struct
+
+import pytest
+
+from sql import Copy, Values
+
+
+def test_copy(table):
+    query = table.copy_from([table.c1, table.c2])
+    assert str(query) == 'COPY "t" ("c1", "c2") FROM STDIN'
+    assert query.params == ()
+
+    query = table.copy_from(format_='csv')
+    assert str(query) == 'COPY "t" FROM STDIN WITH (FORMAT csv)'
+
+    query = Copy(table, [table.c], format_='binary')
+    assert str(query) == 'COPY "t" ("c") FROM STDIN WITH (FORMAT binary)'
+
+
+def test_copy_unknown_format(table):
+    with pytest.raises(ValueError):
+        table.copy_from(format_='xml')
+
+
+def test_copy_text(table):
+    query = table.copy_from()
+    rows = [[1, 'foo\tbar', None],
+            [True, 'back\\slash\n', bytearray(b'\x00\xff')]]
+    data = query.buffer(rows).read()
+    assert data == (b'1\tfoo\\tbar\t\\N\n'
+                    b't\tback\\\\slash\\n\t\\\\x00ff\n')
+    assert b''.join(query.encode(rows)) == data
+
+
+def test_copy_csv(table):
+    query = table.copy_from(format_='csv')
+    rows = [[1, '', None], ['a,b', 'say "hi"', '\\.']]
+    data = query.buffer(rows).read().decode('utf-8')
+    assert data == '1,"",\n"a,b","say ""hi""","\\."\n'
+    assert list(csv.reader(io.StringIO(data))) == [
+        ['1', '', ''], ['a,b', 'say "hi"', '\\.']]
+
+
+def test_copy_binary(table):
+    query = table.copy_from(format_='binary')
+    buffer_ = query.buffer(Values([[1, 'foo'], [None, 2.5]]))
+    assert buffer_.read(11) == b'PGCOPY\n\xff\r\n\x00'
+    assert struct.unpack('!ii', buffer_.read(8)) == (0, 0)
+
+    rows = []
+    while True:
+        count, = struct.unpack('!h', buffer_.read(2))
+        if count == -1:
+            break
+        row = []
+        for _ in range(count):
+            length, = struct.unpack('!i', buffer_.read(4))
+            row.append(None if length == -1 else buffer_.read(length))
+        rows.append(row)
+    assert buffer_.read() == b''
+    assert rows == [
+        [struct.pack('!q', 1), b'foo'],
+        [None, struct.pack('!d', 2.5)]]
+
+
+def test_copy_native_str(table):
+    "Test native str is text on Python 2"
+    for format_, data in [
+            ('text', b'foo\n'),
+            ('csv', b'foo\n'),
+            ('binary', struct.pack('!hi', 1, 3) + b'foo')]:
+        query = table.copy_from(format_=format_)
+        assert b''.join(query.encode([[str('foo')]])) == data
+
+
+def test_copy_expression(table):
+    query = table.copy_from()
+    with pytest.raises(ValueError):
+        list(query.encode([[table.c]]))
@@ -29,7 +29,9 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from sql import With
+import pytest
+
+from sql import With, Conflict, Flavor
 from sql.functions import Abs
 
 
@@ -85,3 +87,92 @@ def test_with(table, t1):
                           'INSERT INTO "t" ("c1") '
                           'SELECT * FROM "a" AS "a"')
     assert query.params == ()
+
+
+def test_insert_on_conflict(table):
+    query = table.insert([table.id, table.c], [[1, 'foo']],
+                         on_conflict=Conflict(table.id))
+    assert str(query) == ('INSERT INTO "t" ("id", "c") VALUES (%s, %s) '
+                          'ON CONFLICT ("id") '
+                          'DO UPDATE SET "c" = EXCLUDED."c"')
+    assert query.params == (1, 'foo')
+
+    query.on_conflict = Conflict(table.id, update=[])
+    assert str(query) == ('INSERT INTO "t" ("id", "c") VALUES (%s, %s) '
+                          'ON CONFLICT ("id") DO NOTHING')
+    assert query.params == (1, 'foo')
+
+
+def test_insert_on_conflict_without_columns(table):
+    query = table.insert(values=[[1, 'foo']], on_conflict=Conflict(table.id))
+    with pytest.raises(ValueError):
+        str(query)
+
+    query.on_conflict = Conflict(table.id, update=[table.c])
+    assert str(query) == ('INSERT INTO "t" VALUES (%s, %s) '
+                          'ON CONFLICT ("id") '
+                          'DO UPDATE SET "c" = EXCLUDED."c"')
+    try:
+        Flavor.set(Flavor(upsert='merge'))
+        with pytest.raises(ValueError):
+            str(query)
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_insert_on_duplicate(table):
+    query = table.insert([table.id, table.c], [[1, 'foo']],
+                         on_conflict=Conflict(table.id))
+    try:
+        Flavor.set(Flavor(upsert='on_duplicate'))
+        assert str(query) == ('INSERT INTO "t" ("id", "c") VALUES (%s, %s) '
+                              'ON DUPLICATE KEY UPDATE "c" = VALUES("c")')
+        assert query.params == (1, 'foo')
+
+        query.on_conflict = Conflict(table.id, update=[])
+        assert str(query) == ('INSERT INTO "t" ("id", "c") VALUES (%s, %s) '
+                              'ON DUPLICATE KEY UPDATE "id" = "id"')
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_insert_merge(table):
+    query = table.insert([table.id, table.c], [[1, 'foo'], [2, 'bar']],
+                         on_conflict=Conflict(table.id))
+    try:
+        Flavor.set(Flavor(upsert='merge'))
+        assert str(query) == (
+            'MERGE INTO "t" AS "a" '
+            'USING (VALUES (%s, %s), (%s, %s)) AS "b" ("id", "c") '
+            'ON ("a"."id" = "b"."id") '
+            'WHEN MATCHED THEN UPDATE SET "c" = "b"."c" '
+            'WHEN NOT MATCHED THEN INSERT ("id", "c") '
+            'VALUES ("b"."id", "b"."c");')
+        assert query.params == (1, 'foo', 2, 'bar')
+
+        query.on_conflict = Conflict(table.id, update=[])
+        assert 'WHEN MATCHED' not in str(query)
+
+        query.returning = [table.id]
+        with pytest.raises(ValueError):
+            str(query)
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_insert_merge_rownum(table):
+    query = table.insert([table.id, table.c], [[1, 'foo'], [2, 'bar']],
+                         on_conflict=Conflict(table.id))
+    try:
+        Flavor.set(Flavor(upsert='merge', limitstyle='rownum', no_as=True))
+        assert str(query) == (
+            'MERGE INTO "t" "a" '
+            'USING (SELECT %s "id", %s "c" FROM dual '
+            'UNION ALL SELECT %s "id", %s "c" FROM dual) "b" '
+            'ON ("a"."id" = "b"."id") '
+            'WHEN MATCHED THEN UPDATE SET "c" = "b"."c" '
+            'WHEN NOT MATCHED THEN INSERT ("id", "c") '
+            'VALUES ("b"."id", "b"."c")')
+        assert query.params == (1, 'foo', 2, 'bar')
+    finally:
+        Flavor.set(Flavor())
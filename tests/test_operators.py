@@ -52,23 +52,40 @@ def test_and(table):
 def test_operator_operators(table):
     and_ = And((Literal(True), table.c1))
     and2 = and_ & And((Literal(True), table.c2))
-    assert str(and2) == '((%s AND "c1") AND %s AND "c2")'
+    assert str(and2) == '(%s AND "c1" AND %s AND "c2")'
     assert and2.params == (True, True)
 
     and3 = and_ & Literal(True)
-    assert str(and3) == '((%s AND "c1") AND %s)'
+    assert str(and3) == '(%s AND "c1" AND %s)'
     assert and3.params == (True, True)
 
     or_ = Or((Literal(True), table.c1))
     or2 = or_ | Or((Literal(True), table.c2))
-    assert str(or2) == '((%s OR "c1") OR %s OR "c2")'
+    assert str(or2) == '(%s OR "c1" OR %s OR "c2")'
     assert or2.params == (True, True)
 
     or3 = or_ | Literal(True)
-    assert str(or3) == '((%s OR "c1") OR %s)'
+    assert str(or3) == '(%s OR "c1" OR %s)'
     assert or3.params == (True, True)
 
 
+def test_operator_chaining(table):
+    and_ = table.c == 0
+    for i in range(1, 10000):
+        and_ = and_ & (table.c == i)
+    assert str(and_) == '(' + ' AND '.join(['("c" = %s)'] * 10000) + ')'
+    assert and_.params == tuple(range(10000))
+
+    or_ = table.c == 0
+    for i in range(1, 10000):
+        or_ = (table.c == i) | or_
+    assert str(or_) == '(' + ' OR '.join(['("c" = %s)'] * 10000) + ')'
+    assert or_.params == tuple(reversed(range(10000)))
+
+    mixed = (table.c1 & table.c2) | (table.c3 & table.c4)
+    assert str(mixed) == '(("c1" AND "c2") OR ("c3" AND "c4"))'
+
+
 def test_operator_compat_column(table):
     and_ = And((table.c1, table.c2))
     assert and_.table == ''
@@ -339,3 +356,76 @@ def test_exists(table):
                            'FROM "t" AS "a" '
                            'WHERE ("a"."c1" = %s)))')
     assert exists.params == (1,)
+
+
+def test_in_array(table):
+    class NDArray(object):
+        def __array__(self):
+            pass
+    ndarray = NDArray()
+    values = array('l', range(3))
+    try:
+        Flavor.set(Flavor(in_array=True))
+        for operand in [[1, 2], (1, 2)]:
+            in_ = In(table.c1, operand)
+            assert str(in_) == '("c1" = ANY(%s))'
+            assert in_.params == ([1, 2],)
+
+        for operand in [values, ndarray]:
+            in_ = In(table.c1, operand)
+            assert str(in_) == '("c1" = ANY(%s))'
+            param, = in_.params
+            assert param is operand
+
+        not_in = NotIn(table.c1, [1, 2])
+        assert str(not_in) == '("c1" != ALL(%s))'
+        assert not_in.params == ([1, 2],)
+
+        in_ = In(table.c1, [table.c2, 1])
+        assert str(in_) == '("c1" IN ("c2", %s))'
+        assert in_.params == (1,)
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_in_buckets(table):
+    try:
+        Flavor.set(Flavor(in_buckets=True))
+        in_ = In(table.c1, [1, 2, 3])
+        assert str(in_) == '("c1" IN (%s, %s, %s, %s))'
+        assert in_.params == (1, 2, 3, 3)
+
+        in_ = NotIn(table.c1, array('l', range(5)))
+        assert str(in_) == '("c1" NOT IN (%s, %s, %s, %s, %s, %s, %s, %s))'
+        assert in_.params == (0, 1, 2, 3, 4, 4, 4, 4)
+
+        in_ = In(table.c1, [1, 2])
+        assert str(in_) == '("c1" IN (%s, %s))'
+        assert in_.params == (1, 2)
+
+        Flavor.set(Flavor(in_buckets=[10, 3]))
+        in_ = In(table.c1, [1, 2])
+        assert str(in_) == '("c1" IN (%s, %s, %s))'
+        assert in_.params == (1, 2, 2)
+        assert len(In(table.c1, list(range(4))).params) == 10
+        assert len(In(table.c1, list(range(11))).params) == 11
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_in_max(table):
+    try:
+        Flavor.set(Flavor(max_in=2))
+        in_ = In(table.c1, [1, 2, 3])
+        assert str(in_) == '(("c1" IN (%s, %s)) OR ("c1" IN (%s)))'
+        assert in_.params == (1, 2, 3)
+
+        in_ = NotIn(Literal('foo'), array('l', range(4)))
+        assert str(in_) == ('((%s NOT IN (%s, %s)) AND '
+                            '(%s NOT IN (%s, %s)))')
+        assert in_.params == ('foo', 0, 1, 'foo', 2, 3)
+
+        in_ = In(table.c1, [1, 2])
+        assert str(in_) == '("c1" IN (%s, %s))'
+    finally:
+        Flavor.set(Flavor())
@@ -0,0 +1,644 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011-2016, Cédric Krier
+# Copyright (c) 2011-2016, B2CK
+# Copyright (c) 2016-2016, Victor Uriarte
+# and contributors. See AUTHORS for more details.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+
+from sql import Flavor, Table, With, Values, Case, Literal, Null
+from sql.aggregate import Count, Sum
+from sql.operators import And, Or, Not, Exists
+from sql.optimize import (
+    in_to_join, case_to_join, normalize, simplify, is_empty,
+    hoist_subqueries, push_predicates, reduce_sorts, in_to_exists,
+    or_to_union, prune_columns, eliminate_joins, deferred_join)
+
+
+def test_in_to_join(t1, t2):
+    query = t1.join(t2, condition=t1.id == t2.t1).select(
+        t1.id, where=(t1.c == 'foo') & t2.c.in_([1, 2, 2, None, 3]))
+    optimized = in_to_join(query, threshold=2)
+    assert str(optimized) == (
+        'SELECT "a"."id" FROM "t1" AS "a" '
+        'INNER JOIN "t2" AS "b" ON ("a"."id" = "b"."t1") '
+        'INNER JOIN (VALUES (%s), (%s), (%s)) AS "c" ("c") '
+        'ON ("b"."c" = "c"."c") '
+        'WHERE ("a"."c" = %s)')
+    assert optimized.params == (1, 2, 3, 'foo')
+    assert query.where[1].right == [1, 2, 2, None, 3]
+
+
+def test_in_to_join_threshold(table):
+    query = table.select(table.c, where=table.c.in_([1, 2, 3]))
+    assert in_to_join(query) is query
+    assert in_to_join(query, threshold=3) is query
+    try:
+        Flavor.set(Flavor(in_join_threshold=2))
+        assert str(in_to_join(query)) == (
+            'SELECT "a"."c" FROM "t" AS "a" '
+            'INNER JOIN (VALUES (%s), (%s), (%s)) AS "b" ("c") '
+            'ON ("a"."c" = "b"."c")')
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_in_to_join_star(table):
+    query = table.select(where=table.c.in_([1, 2, 3]))
+    assert in_to_join(query, threshold=1) is query
+
+
+def test_case_to_join(table):
+    case = Case((table.code == 1, 'one'), (table.code == 2, 'two'),
+                (table.code == 1, 'uno'), else_='other')
+    query = table.select(table.id, case.as_('label'),
+                         where=table.active == Literal(True))
+    optimized = case_to_join(query)
+    assert str(optimized) == (
+        'SELECT "a"."id", COALESCE("b"."value", %s) AS "label" '
+        'FROM "t" AS "a" LEFT JOIN (VALUES (%s, %s), (%s, %s)) '
+        'AS "b" ("key", "value") ON ("a"."code" = "b"."key") '
+        'WHERE ("a"."active" = %s)')
+    assert optimized.params == ('other', 1, 'one', 2, 'two', True)
+    assert query.columns[1].expression is case
+
+    case.else_ = None
+    assert str(case_to_join(table.select(case))) == (
+        'SELECT "b"."value" FROM "t" AS "a" '
+        'LEFT JOIN (VALUES (%s, %s), (%s, %s)) AS "b" ("key", "value") '
+        'ON ("a"."code" = "b"."key")')
+
+    assert case_to_join(query, threshold=3) is query
+
+
+def test_case_to_join_not_lookup(table, t2):
+    for case in [
+            Case((table.code == 1, 'one'), (table.code > 2, 'two')),
+            Case((table.code == 1, 'one'), (table.other == 2, 'two')),
+            Case((table.code == 1, table.name)),
+            Case((table.code == Null, 'none')),
+            Case((table.code == 1, None), else_='other'),
+            Case((t2.code == 1, 'one'))]:
+        query = table.select(case)
+        assert case_to_join(query) is query
+
+
+def test_case_to_join_aggregate(table):
+    case = Case((table.code == 1, 'one'), (table.code == 2, 'two'))
+    for query in [
+            table.select(case, Count(table.id), group_by=[case]),
+            table.select(case, group_by=[table.code]),
+            table.select(case.as_('label'), Sum(table.amount),
+                         group_by=[table.code])]:
+        assert case_to_join(query) is query
+
+
+def test_normalize(table):
+    where = And([table.a == 1,
+                 And([table.b == 2, And([table.c == 3, Literal(True)])]),
+                 table.a == 1, ~~(table.d > 4), ~(table.e == 5),
+                 Not(Literal(False))])
+    query = table.select(where=where)
+    normalized = normalize(query)
+    assert str(normalized) == (
+        'SELECT * FROM "t" AS "a" WHERE (("a"."a" = %s) AND ("a"."b" = %s) '
+        'AND ("a"."c" = %s) AND ("a"."d" > %s) AND ("a"."e" != %s))')
+    assert normalized.params == (1, 2, 3, 4, 5)
+    assert query.where is where
+
+
+def test_normalize_or(table):
+    query = table.select(
+        where=Or([table.a == 1, Or([Literal(False), table.a == 1])]))
+    assert str(normalize(query)) == (
+        'SELECT * FROM "t" AS "a" WHERE ("a"."a" = %s)')
+
+
+def test_normalize_absorbing(table):
+    query = table.select(where=(table.a == 1) | Literal(True),
+                         having=(table.b == 1) & Literal(False))
+    normalized = normalize(query)
+    assert str(normalized) == 'SELECT * FROM "t" AS "a" HAVING %s'
+    assert normalized.params == (False,)
+
+
+def test_normalize_unchanged(table):
+    query = table.select(where=(table.a == 1) & (table.b == 2))
+    assert normalize(query) is query
+    query = table.delete(where=(table.a == 1) & (table.a == 1))
+    assert str(normalize(query)) == 'DELETE FROM "t" WHERE ("a" = %s)'
+
+
+def test_simplify_or_to_in(table):
+    query = table.select(where=(table.a == 1) | (table.b == 2)
+                         | (table.a == 3) | table.a.in_([1, 4]))
+    simplified = simplify(query)
+    assert str(simplified) == (
+        'SELECT * FROM "t" AS "a" WHERE (("a"."a" IN (%s, %s, %s)) '
+        'OR ("a"."b" = %s))')
+    assert simplified.params == (1, 3, 4, 2)
+
+
+def test_simplify_range(table):
+    query = table.select(where=(table.a > 1) & (table.a >= 3)
+                         & (table.b == 1) & (table.a < 10) & (table.a <= 10))
+    simplified = simplify(query)
+    assert str(simplified) == (
+        'SELECT * FROM "t" AS "a" WHERE (("a"."a" >= %s) '
+        'AND ("a"."a" < %s) AND ("a"."b" = %s))')
+    assert simplified.params == (3, 10, 1)
+
+
+def test_simplify_equal_in_range(table):
+    query = table.select(where=(table.a >= 1) & (table.a == 2))
+    assert str(simplify(query)) == (
+        'SELECT * FROM "t" AS "a" WHERE ("a"."a" = %s)')
+
+
+def test_simplify_contradiction(table):
+    for where in [
+            (table.a == 1) & (table.a == 2),
+            (table.a > 2) & (table.a <= 2),
+            (table.a >= 3) & (table.a == 2)]:
+        simplified = simplify(table.select(where=where))
+        assert str(simplified) == 'SELECT * FROM "t" AS "a" WHERE %s'
+        assert simplified.params == (False,)
+
+    query = table.select(where=((table.a == 1) & (table.a == 2))
+                         | (table.b == 3))
+    assert str(simplify(query)) == (
+        'SELECT * FROM "t" AS "a" WHERE ("a"."b" = %s)')
+
+
+def test_simplify_strings(table):
+    "Test strings are not merged as they depend on the collation"
+    for where in [
+            (table.s >= 'a') & (table.s <= 'B'),
+            (table.s == 'a') & (table.s == 'A'),
+            (table.s > b'b') & (table.s < b'a')]:
+        query = table.select(where=where)
+        assert simplify(query) is query
+        assert not is_empty(query)
+
+
+def test_simplify_dates(table):
+    query = table.select(where=(table.d >= datetime.date(2020, 1, 1))
+                         & (table.d < datetime.date(2019, 1, 1)))
+    assert is_empty(query)
+
+
+def test_simplify_unchanged(table):
+    query = table.select(where=And([
+        table.a >= 2, table.a <= 2, table.b > 'x', table.b < 1]))
+    assert simplify(query) is query
+
+
+def test_is_empty(table):
+    where = (table.a == 1) & (table.a == 2)
+    assert is_empty(table.select(where=where))
+    assert is_empty(table.delete(where=where))
+    assert not is_empty(table.select(Count(Literal('*')), where=where))
+    assert not is_empty(table.select(where=table.a == 1))
+
+
+def test_normalize_chained(table):
+    where = table.a == 0
+    for i in range(1, 10000):
+        where = where & (table.a == i % 100)
+    normalized = normalize(table.select(where=where))
+    assert len(normalized.where) == 100
+    assert normalized.params == tuple(range(100))
+
+
+def test_hoist_subqueries(table):
+    other = Table('u')
+    query = table.select(
+        where=table.a.in_(other.select(other.id, where=other.x == 1))
+        | table.b.in_(other.select(other.id, where=other.x == 1)))
+    hoisted = hoist_subqueries(query)
+    assert str(hoisted) == (
+        'WITH "b" AS (SELECT "c"."id" FROM "u" AS "c" '
+        'WHERE ("c"."x" = %s)) '
+        'SELECT * FROM "t" AS "a" '
+        'WHERE (("a"."a" IN (SELECT * FROM "b" AS "b")) '
+        'OR ("a"."b" IN (SELECT * FROM "b" AS "b")))')
+    assert hoisted.params == (1,)
+    assert query.with_ is None
+
+
+def test_hoist_subqueries_from(table):
+    other = Table('u')
+    subquery = other.select(other.id, where=other.x == 1)
+    query = table.join(subquery, condition=table.id == subquery.id).select(
+        table.a, subquery.id, where=table.b.in_(subquery))
+    hoisted = hoist_subqueries(query)
+    assert str(hoisted) == (
+        'WITH "b" AS (SELECT "c"."id" FROM "u" AS "c" '
+        'WHERE ("c"."x" = %s)) '
+        'SELECT "a"."a", "b"."id" FROM "t" AS "a" '
+        'INNER JOIN "b" AS "b" ON ("a"."id" = "b"."id") '
+        'WHERE ("a"."b" IN (SELECT * FROM "b" AS "b"))')
+    assert hoisted.params == (1,)
+
+
+def test_hoist_subqueries_self_join():
+    other = Table('u')
+    s1 = other.select(other.id, other.x, where=other.y == 1)
+    s2 = other.select(other.id, other.x, where=other.y == 1)
+    query = s1.join(s2, condition=s1.id == s2.x).select(s1.id, s2.id)
+    hoisted = hoist_subqueries(query)
+    assert str(hoisted) == (
+        'WITH "a" AS (SELECT "c"."id", "c"."x" FROM "u" AS "c" '
+        'WHERE ("c"."y" = %s)) '
+        'SELECT "a"."id", "b"."id" FROM "a" AS "a" '
+        'INNER JOIN (SELECT * FROM "a" AS "a") AS "b" '
+        'ON ("a"."id" = "b"."x")')
+    assert hoisted.params == (1,)
+
+
+def test_hoist_subqueries_nested(table):
+    other = Table('u')
+    inner = other.select(other.id)
+    query = table.select(where=And([
+        table.a.in_(inner.select(inner.id, where=inner.id > 1)),
+        table.b.in_(inner.select(inner.id, where=inner.id > 1)),
+        table.c.in_(other.select(other.id))]))
+    assert str(hoist_subqueries(query)) == (
+        'WITH "c" AS (SELECT "d"."id" FROM "u" AS "d"), '
+        '"b" AS (SELECT "c"."id" FROM "c" AS "c" WHERE ("c"."id" > %s)) '
+        'SELECT * FROM "t" AS "a" '
+        'WHERE (("a"."a" IN (SELECT * FROM "b" AS "b")) '
+        'AND ("a"."b" IN (SELECT * FROM "b" AS "b")) '
+        'AND ("a"."c" IN (SELECT * FROM "c" AS "c")))')
+
+
+def test_hoist_subqueries_recursive():
+    upto = With('n', recursive=True, query=Values([(1,)]))
+    query = upto.select(
+        where=upto.n.in_(upto.select(upto.n, where=upto.n > 1))
+        & upto.n.in_(upto.select(upto.n, where=upto.n > 1)),
+        with_=[upto])
+    assert str(hoist_subqueries(query)) == (
+        'WITH RECURSIVE "a" ("n") AS (VALUES (%s)), '
+        '"b" AS (SELECT "a"."n" FROM "a" AS "a" WHERE ("a"."n" > %s)) '
+        'SELECT * FROM "a" AS "a" '
+        'WHERE (("a"."n" IN (SELECT * FROM "b" AS "b")) '
+        'AND ("a"."n" IN (SELECT * FROM "b" AS "b")))')
+
+
+def test_hoist_subqueries_correlated(table):
+    other = Table('u')
+    subquery = other.select(other.id, where=other.x == table.a)
+    query = table.select(where=Exists(subquery) | Exists(subquery))
+    assert hoist_subqueries(query) is query
+
+
+def test_push_predicates(table):
+    other = Table('u')
+    subquery = other.select(
+        other.id, (other.x + 1).as_('y'), where=other.z == 1)
+    query = subquery.select(
+        subquery.id,
+        where=(subquery.y > 5) & subquery.id.in_(table.select(table.id)))
+    pushed = push_predicates(query)
+    assert str(pushed) == (
+        'SELECT "a"."id" FROM (SELECT "b"."id", ("b"."x" + %s) AS "y" '
+        'FROM "u" AS "b" WHERE (("b"."z" = %s) AND (("b"."x" + %s) > %s))) '
+        'AS "a" WHERE ("a"."id" IN (SELECT "c"."id" FROM "t" AS "c"))')
+    assert pushed.params == (1, 1, 1, 5)
+    assert query.where is not None
+
+
+def test_push_predicates_table(table):
+    subquery = table.select()
+    query = subquery.select(where=subquery.c == 2)
+    assert str(push_predicates(query)) == (
+        'SELECT * FROM (SELECT * FROM "t" AS "b" WHERE ("b"."c" = %s)) '
+        'AS "a"')
+
+
+def test_push_predicates_with(table):
+    with_ = With('a', 'b', query=table.select(table.id, table.x))
+    query = with_.select(with_.a, where=with_.b > 2, with_=[with_])
+    assert str(push_predicates(query)) == (
+        'WITH "a" ("a", "b") AS (SELECT "b"."id", "b"."x" FROM "t" AS "b" '
+        'WHERE ("b"."x" > %s)) SELECT "a"."a" FROM "a" AS "a"')
+
+    query = (with_ + with_).select(where=with_.b > 2, with_=[with_])
+    assert push_predicates(query) is query
+
+
+def test_push_predicates_barrier(table):
+    for subquery in [
+            table.select(table.c, limit=10),
+            table.select(table.c, group_by=[table.c]),
+            table.select(Count(table.c).as_('c'))]:
+        query = subquery.select(where=subquery.c > 1)
+        assert push_predicates(query) is query
+
+
+def test_reduce_sorts_subqueries(table):
+    other = Table('u')
+    query = table.select(where=And([
+        table.a.in_(other.select(other.id, order_by=other.id)),
+        Exists(other.select(order_by=other.x)),
+        table.b.in_(other.select(other.id, order_by=other.id, limit=3))]))
+    reduced = reduce_sorts(query)
+    assert str(reduced) == (
+        'SELECT * FROM "t" AS "a" WHERE ('
+        '("a"."a" IN (SELECT "b"."id" FROM "u" AS "b")) '
+        'AND (EXISTS (SELECT * FROM "u" AS "b")) '
+        'AND ("a"."b" IN (SELECT "b"."id" FROM "u" AS "b" '
+        'ORDER BY "b"."id" LIMIT 3)))')
+    assert query.where[0].right.order_by
+
+
+def test_reduce_sorts_from(table):
+    subquery = table.select(table.id, order_by=table.id)
+    query = subquery.select(subquery.id, order_by=subquery.id)
+    assert str(reduce_sorts(query)) == (
+        'SELECT "a"."id" FROM (SELECT "b"."id" FROM "t" AS "b") AS "a" '
+        'ORDER BY "a"."id"')
+
+    query = subquery.select(Count(Literal('*')))
+    assert str(reduce_sorts(query)) == (
+        'SELECT COUNT(%s) FROM (SELECT "b"."id" FROM "t" AS "b") AS "a"')
+
+    query = subquery.select(subquery.id)
+    assert reduce_sorts(query) is query
+
+
+def test_reduce_sorts_union_limit(table):
+    other = Table('u')
+    union = table.select(table.a) | other.select(other.a, limit=5)
+    union.all_ = True
+    union.limit = 10
+    union.offset = 2
+    assert str(reduce_sorts(union)) == (
+        'SELECT * FROM (SELECT "b"."a" FROM "t" AS "b" LIMIT 12) AS "a" '
+        'UNION ALL SELECT "c"."a" FROM "u" AS "c" LIMIT 5 '
+        'LIMIT 10 OFFSET 2')
+
+    union.all_ = False
+    assert reduce_sorts(union) is union
+
+
+def test_in_to_exists(table):
+    other = Table('u')
+    query = table.select(where=And([
+        table.a.in_(other.select(other.id, where=other.x == 1)),
+        ~table.b.in_(other.select(other.id)),
+        table.c.in_([1, 2])]))
+    try:
+        Flavor.set(Flavor(in_exists=True))
+        assert str(in_to_exists(query)) == (
+            'SELECT * FROM "t" AS "a" WHERE ('
+            '(EXISTS (SELECT "b"."id" FROM "u" AS "b" '
+            'WHERE (("b"."x" = %s) AND ("b"."id" = "a"."a")))) '
+            'AND ("a"."b" NOT IN (SELECT "b"."id" FROM "u" AS "b")) '
+            'AND ("a"."c" IN (%s, %s)))')
+        assert str(in_to_exists(query, not_null=[table.b, other.id])) == (
+            'SELECT * FROM "t" AS "a" WHERE ('
+            '(EXISTS (SELECT "b"."id" FROM "u" AS "b" '
+            'WHERE (("b"."x" = %s) AND ("b"."id" = "a"."a")))) '
+            'AND (NOT (EXISTS (SELECT "b"."id" FROM "u" AS "b" '
+            'WHERE ("b"."id" = "a"."b")))) '
+            'AND ("a"."c" IN (%s, %s)))')
+    finally:
+        Flavor.set(Flavor())
+    assert in_to_exists(query) is query
+
+
+def test_in_to_exists_unsafe(table):
+    other = Table('u')
+    try:
+        Flavor.set(Flavor(in_exists=True))
+        for subquery in [
+                other.select(other.id, limit=1),
+                other.select(Count(other.id)),
+                other.select(other.id, group_by=[other.id])]:
+            query = table.select(where=table.a.in_(subquery))
+            assert in_to_exists(query) is query
+        query = table.select(
+            where=Or([table.a.in_(other.select(other.id)), table.b == 1]))
+        assert in_to_exists(query) is query
+        query = table.delete(where=table.a.in_(other.select(other.id)))
+        assert in_to_exists(query) is query
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_in_to_exists_self_reference(table):
+    query = table.select(
+        table.a, where=table.a.in_(table.select(table.b, where=table.c == 1)))
+    try:
+        Flavor.set(Flavor(in_exists=True))
+        assert in_to_exists(query) is query
+        join = table.join(Table('u'))
+        query = join.select(where=table.a.in_(table.select(table.b)))
+        assert in_to_exists(query) is query
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_or_to_union(table):
+    query = table.select(
+        table.id, where=(table.x > 0) & ((table.a == 1) | (table.b == 2)))
+    union = or_to_union(query)
+    assert str(union) == (
+        'SELECT "a"."id" FROM "t" AS "a" '
+        'WHERE (("a"."x" > %s) AND ("a"."a" = %s)) '
+        'UNION ALL SELECT "a"."id" FROM "t" AS "a" '
+        'WHERE (("a"."x" > %s) AND ("a"."b" = %s) '
+        'AND (NOT COALESCE(("a"."a" = %s), %s)))')
+    assert union.params == (0, 1, 0, 2, 1, False)
+
+    union = or_to_union(query, distinct=True)
+    assert str(union) == (
+        'SELECT "a"."id" FROM "t" AS "a" '
+        'WHERE (("a"."x" > %s) AND ("a"."a" = %s)) '
+        'UNION SELECT "a"."id" FROM "t" AS "a" '
+        'WHERE (("a"."x" > %s) AND ("a"."b" = %s))')
+    assert union.params == (0, 1, 0, 2)
+
+
+def test_or_to_union_unchanged(table):
+    where = (table.a == 1) | (table.b == 2)
+    for query in [
+            table.select(where=table.a == 1),
+            table.select(where=where, order_by=table.a),
+            table.select(where=where, limit=1),
+            table.select(table.a, where=where, group_by=[table.a]),
+            table.select(Count(table.a), where=where)]:
+        assert or_to_union(query) is query
+
+
+def test_prune_columns(table):
+    subquery = table.select(
+        table.id, table.a, (table.b + 1).as_('c'), Sum(table.x).as_('s'),
+        group_by=[table.id, table.a, table.b])
+    query = subquery.select(subquery.id, where=subquery.c > 1)
+    pruned = prune_columns(query)
+    assert str(pruned) == (
+        'SELECT "a"."id" FROM (SELECT "b"."id", ("b"."b" + %s) AS "c" '
+        'FROM "t" AS "b" GROUP BY "b"."id", "b"."a", "b"."b") AS "a" '
+        'WHERE ("a"."c" > %s)')
+    assert pruned.params == (1, 1)
+
+    query = subquery.select(Count(Literal('*')))
+    assert str(prune_columns(query)) == (
+        'SELECT COUNT(%s) FROM (SELECT "b"."id" FROM "t" AS "b" '
+        'GROUP BY "b"."id", "b"."a", "b"."b") AS "a"')
+
+    query = subquery.select()
+    assert prune_columns(query) is query
+
+
+def test_prune_columns_star(table):
+    subquery = table.select()
+    query = subquery.select(subquery.a, where=subquery.c == 1)
+    assert str(prune_columns(query)) == (
+        'SELECT "a"."a" FROM (SELECT "b"."a", "b"."c" FROM "t" AS "b") AS "a" '
+        'WHERE ("a"."c" = %s)')
+
+
+def test_prune_columns_nested(table):
+    inner = table.select(table.id, table.a, table.b)
+    middle = inner.select(inner.id, inner.a)
+    query = middle.select(middle.id)
+    assert str(prune_columns(query)) == (
+        'SELECT "a"."id" FROM (SELECT "b"."id" FROM '
+        '(SELECT "c"."id" FROM "t" AS "c") AS "b") AS "a"')
+
+
+def test_prune_columns_union(table):
+    other = Table('u')
+    union = table.select(table.id, table.a) | other.select(other.id, other.b)
+    union.all_ = True
+    query = union.select(union.a)
+    assert str(prune_columns(query)) == (
+        'SELECT "a"."a" FROM (SELECT "b"."a" FROM "t" AS "b" '
+        'UNION ALL SELECT "c"."b" FROM "u" AS "c") AS "a"')
+
+    union.all_ = False
+    assert prune_columns(query) is query
+
+
+def test_prune_columns_order_position(table):
+    subquery = table.select(table.id, table.a, order_by=Literal(2))
+    query = subquery.select(subquery.id)
+    assert prune_columns(query) is query
+
+
+def test_eliminate_joins(table):
+    other = Table('u', keys=['id'])
+    another = Table('v', keys=[('a', 'b')])
+    join = table.join(other, 'LEFT', condition=table.uid == other.id).join(
+        another, 'LEFT',
+        condition=(another.a == table.x) & (another.b == other.id))
+    query = join.select(table.id, where=table.x > 0)
+    eliminated = eliminate_joins(query)
+    assert str(eliminated) == (
+        'SELECT "a"."id" FROM "t" AS "a" WHERE ("a"."x" > %s)')
+    assert eliminated.params == (0,)
+    assert query.from_[0] is join
+
+
+def test_eliminate_joins_extra_condition(table):
+    other = Table('u', keys=['id'])
+    join = table.join(other, 'LEFT',
+                      condition=(table.uid == other.id) & other.active)
+    assert str(eliminate_joins(join.select(table.id))) == (
+        'SELECT "a"."id" FROM "t" AS "a"')
+
+
+def test_eliminate_joins_kept(table):
+    other = Table('u', keys=['id'])
+    another = Table('v', keys=[('a', 'b')])
+    keyless = Table('w')
+    for join, columns in [
+            (table.join(other, 'LEFT', condition=table.uid == other.id),
+                [other.name]),
+            (table.join(other, condition=table.uid == other.id), []),
+            (table.join(another, 'LEFT', condition=another.a == table.x),
+                []),
+            (table.join(keyless, 'LEFT', condition=table.uid == keyless.id),
+                [])]:
+        query = join.select(table.id, *columns)
+        assert eliminate_joins(query) is query
+
+
+def test_eliminate_joins_star(table):
+    other = Table('u', keys=['id'])
+    join = table.join(other, 'LEFT', condition=table.uid == other.id)
+    query = join.select()
+    assert eliminate_joins(query) is query
+
+    outer = Table('x')
+    query = outer.select(where=outer.uid.in_(join.select(table.uid)))
+    assert str(eliminate_joins(query)) == (
+        'SELECT * FROM "x" AS "a" WHERE ("a"."uid" IN ('
+        'SELECT "b"."uid" FROM "t" AS "b"))')
+
+
+def test_deferred_join():
+    table = Table('t', keys=['id'])
+    query = table.select(table.id, table.a, where=table.x == 1,
+                         order_by=[table.a.desc, table.id],
+                         limit=10, offset=10000)
+    deferred = deferred_join(query)
+    assert str(deferred) == (
+        'SELECT "a"."id", "a"."a" FROM "t" AS "a" '
+        'INNER JOIN (SELECT "a"."id" FROM "t" AS "a" WHERE ("a"."x" = %s) '
+        'ORDER BY "a"."a" DESC, "a"."id" LIMIT 10 OFFSET 10000) AS "b" '
+        'ON ("a"."id" = "b"."id") ORDER BY "a"."a" DESC, "a"."id"')
+    assert deferred.params == (1,)
+    assert query.offset == 10000
+
+
+def test_deferred_join_composite_key():
+    table = Table('t', keys=[('a', 'b')])
+    query = table.select(table.c, order_by=table.c, limit=10, offset=100)
+    assert str(deferred_join(query)) == (
+        'SELECT "a"."c" FROM "t" AS "a" '
+        'INNER JOIN (SELECT "a"."a", "a"."b" FROM "t" AS "a" '
+        'ORDER BY "a"."c" LIMIT 10 OFFSET 100) AS "b" '
+        'ON (("a"."a" = "b"."a") AND ("a"."b" = "b"."b")) '
+        'ORDER BY "a"."c"')
+
+
+def test_deferred_join_unchanged(table):
+    keyed = Table('t', keys=['id'])
+    for query in [
+            table.select(order_by=table.c, limit=10, offset=100),
+            keyed.select(order_by=keyed.c, limit=10),
+            keyed.select(limit=10, offset=100),
+            keyed.select(order_by=keyed.c, limit=10, offset=100),
+            keyed.select(Count(keyed.c), order_by=keyed.c, limit=10,
+                         offset=100)]:
+        assert deferred_join(query) is query
@@ -31,8 +31,12 @@
 
 from copy import deepcopy
 
-from sql import Join, Union, Literal, Flavor, For, With, Window, Select
-from sql.aggregate import Min
+import pytest
+
+from sql import (
+    Join, Union, Literal, Flavor, For, With, Window, Select, Asc, Desc,
+    NullsFirst, Table)
+from sql.aggregate import Min, Sum
 from sql.functions import Now, Function, Rank, DatePart
 
 
@@ -354,6 +358,41 @@ def test_window(table):
     assert query.params == ('year',)
 
 
+def test_window_structural(table):
+    query = table.select(
+        Min(table.c1, window=Window([table.c2], order_by=table.c3)),
+        Min(table.c4, window=Window([table.c2], order_by=table.c3)),
+        Min(table.c1, window=Window([table.c2])),
+        Min(table.c1, window=Window([Literal(1)])),
+        Min(table.c1, window=Window([Literal(2)])))
+    assert str(query) == (
+        'SELECT MIN("a"."c1") OVER "b", MIN("a"."c4") OVER "b", '
+        'MIN("a"."c1") OVER "d", MIN("a"."c1") OVER "e", '
+        'MIN("a"."c1") OVER "f" FROM "t" AS "a" '
+        'WINDOW "b" AS (PARTITION BY "a"."c2" ORDER BY "a"."c3"), '
+        '"d" AS (PARTITION BY "a"."c2"), "e" AS (PARTITION BY %s), '
+        '"f" AS (PARTITION BY %s)')
+    assert query.params == (1, 2)
+
+
+def test_window_compiled_once(table, monkeypatch):
+    calls = []
+    windows = Select._windows
+
+    def count(self):
+        if self._compiled_windows is None:
+            calls.append(self)
+        return windows(self)
+    monkeypatch.setattr(Select, '_windows', count)
+    query = table.select(Min(table.c1, window=Window([Literal(1)])))
+    sql, params = query
+    assert sql == ('SELECT MIN("a"."c1") OVER "b" FROM "t" AS "a" '
+                   'WINDOW "b" AS (PARTITION BY %s)')
+    assert params == (1,)
+    assert len(calls) == 1
+    assert query._compiled_windows is None
+
+
 def test_order_params(table):
     with_ = With(query=table.select(table.c, where=(table.c > 1)))
     w = Window([Literal(8)])
@@ -375,3 +414,126 @@ def test_no_as(table):
         assert query.params == ()
     finally:
         Flavor.set(Flavor())
+
+
+def test_select_paginate_after(table):
+    query = table.select(table.id, where=table.c == 'foo',
+                         order_by=[table.a, table.id], offset=100)
+    page = query.paginate_after((1, 2))
+    assert str(page) == ('SELECT "a"."id" FROM "t" AS "a" '
+                         'WHERE (("a"."c" = %s) AND '
+                         '(("a"."a", "a"."id") > (%s, %s))) '
+                         'ORDER BY "a"."a", "a"."id"')
+    assert page.params == ('foo', 1, 2)
+    assert query.offset == 100
+
+    query = table.select(table.id, order_by=Desc(table.id))
+    page = query.paginate_after([5])
+    assert str(page) == ('SELECT "a"."id" FROM "t" AS "a" '
+                         'WHERE ("a"."id" < %s) ORDER BY "a"."id" DESC')
+    assert page.params == (5,)
+
+
+def test_select_paginate_after_mixed(table):
+    query = table.select(table.id, order_by=[Desc(table.a), Asc(table.id)])
+    page = query.paginate_after((1, 2))
+    assert str(page) == ('SELECT "a"."id" FROM "t" AS "a" '
+                         'WHERE (("a"."a" < %s) OR '
+                         '(("a"."a" = %s) AND ("a"."id" > %s))) '
+                         'ORDER BY "a"."a" DESC, "a"."id" ASC')
+    assert page.params == (1, 1, 2)
+
+
+def test_select_paginate_after_no_row_values(table):
+    query = table.select(table.id, order_by=[table.a, table.id])
+    try:
+        Flavor.set(Flavor(row_values=False))
+        page = query.paginate_after((1, 2))
+        assert str(page) == ('SELECT "a"."id" FROM "t" AS "a" '
+                             'WHERE (("a"."a" > %s) OR '
+                             '(("a"."a" = %s) AND ("a"."id" > %s))) '
+                             'ORDER BY "a"."a", "a"."id"')
+        assert page.params == (1, 1, 2)
+    finally:
+        Flavor.set(Flavor())
+
+
+def test_select_paginate_after_invalid(table):
+    with pytest.raises(ValueError):
+        table.select().paginate_after((1,))
+    with pytest.raises(ValueError):
+        table.select(order_by=NullsFirst(table.c)).paginate_after((1,))
+
+
+def test_select_iter_pages(table):
+    query = table.select(table.id, order_by=table.id)
+    pages = query.iter_pages(10)
+    page = next(pages)
+    assert str(page) == ('SELECT "a"."id" FROM "t" AS "a" '
+                         'ORDER BY "a"."id" LIMIT 10')
+    page = pages.send((42,))
+    assert str(page) == ('SELECT "a"."id" FROM "t" AS "a" '
+                         'WHERE ("a"."id" > %s) ORDER BY "a"."id" LIMIT 10')
+    assert page.params == (42,)
+    assert query.limit is None
+
+
+def test_select_without_from():
+    query = Select([Literal(1)])
+    assert str(query) == 'SELECT %s'
+    assert query.params == (1,)
+
+
+def test_count(table):
+    other = Table('u')
+    with_ = With(query=other.select(other.id))
+    query = table.select(
+        table.a, Min(table.b, window=Window([table.c])),
+        where=table.x.in_(with_.select(with_.id)), order_by=table.a,
+        with_=[with_])
+    count = query.count()
+    assert str(count) == (
+        'WITH "c" AS (SELECT "d"."id" FROM "u" AS "d") '
+        'SELECT COUNT(*) FROM (SELECT %s FROM "t" AS "b" '
+        'WHERE ("b"."x" IN (SELECT "c"."id" FROM "c" AS "c"))) AS "a"')
+    assert count.params == (1,)
+    assert query.order_by
+
+
+def test_count_aggregate(table):
+    query = table.select(Sum(table.a))
+    assert str(query.count()) == (
+        'SELECT COUNT(*) FROM (SELECT SUM("b"."a") FROM "t" AS "b") AS "a"')
+
+    query = table.select(table.a, Sum(table.b), group_by=[table.a])
+    assert str(query.count()) == (
+        'SELECT COUNT(*) FROM (SELECT %s FROM "t" AS "b" '
+        'GROUP BY "b"."a") AS "a"')
+
+
+def test_count_union(table, query2):
+    union = table.select(table.a) | query2
+    union.order_by = Literal(1)
+    assert str(union.count()) == (
+        'SELECT COUNT(*) FROM (SELECT "b"."a" FROM "t" AS "b" '
+        'UNION SELECT * FROM "t2" AS "c") AS "a"')
+
+
+def test_exists(table):
+    query = table.select(table.a, where=table.b > 1, order_by=table.a)
+    exists = query.exists()
+    assert str(exists) == (
+        'SELECT (EXISTS (SELECT %s FROM "t" AS "a" '
+        'WHERE ("a"."b" > %s) LIMIT 1))')
+    assert exists.params == (1, 1)
+
+    query = table.select(limit=10, offset=5)
+    assert str(query.exists()) == (
+        'SELECT (EXISTS (SELECT %s FROM "t" AS "a" LIMIT 10 OFFSET 5))')
+
+
+def test_exists_union(table, query2):
+    union = table.select(table.a) | query2
+    assert str(union.exists()) == (
+        'SELECT (EXISTS (SELECT "a"."a" FROM "t" AS "a" '
+        'UNION SELECT * FROM "t2" AS "b" LIMIT 1))')
@@ -45,3 +45,10 @@ def test_schema():
 def test_database():
     t = Table('mytable', database='mydatabase', schema='myschema')
     assert str(t) == '"mydatabase"."myschema"."mytable"'
+
+
+def test_keys():
+    t = Table('mytable', keys=['id', ('code', 'company')])
+    assert str(t) == '"mytable"'
+    assert t._keys == (('id',), ('code', 'company'))
+    assert Table('mytable')._keys == ()
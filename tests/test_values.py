@@ -56,3 +56,11 @@ def test_union():
     values |= Values([[2]])
     assert str(values) == 'VALUES (%s) UNION VALUES (%s)'
     assert values.params == (1, 2)
+
+
+def test_columns():
+    values = Values([[1, 'foo']], columns=['id', 'name'])
+    query = values.select(values.name)
+    assert str(query) == ('SELECT "a"."name" FROM '
+                          '(VALUES (%s, %s)) AS "a" ("id", "name")')
+    assert query.params == (1, 'foo')